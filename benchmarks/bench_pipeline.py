@@ -0,0 +1,193 @@
+"""End-to-end benchmark of the notebook translation pipeline against the offline LocalTranslationBackend.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_pipeline --cells 500 --shapes short,long --latency 0.05
+    python -m benchmarks.bench_pipeline --save_baseline benchmarks/baseline.json
+    python -m benchmarks.bench_pipeline --baseline benchmarks/baseline.json
+"""
+import asyncio
+import functools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import fire
+
+from src.backends import LocalTranslationBackend
+from src.nb_translator import NbTranslator
+
+SHAPES = ('short', 'long', 'code', 'images', 'math', 'mixed')
+
+WORDS = ('the model data training layer input output value function returns each notebook cell '
+         'gradient loss accuracy batch tensor feature label vector matrix example dataset').split()
+
+# Stages timed in CPU seconds, by the NbTranslator methods which implement them.
+# segmentation includes preprocess, and rebuild includes postprocess.
+STAGE_METHODS = {
+    'json_io': ('_load_notebook', '_save_notebook'),
+    'segmentation': ('_segment_cell',),
+    'preprocess': ('_preprocess',),
+    'packing': ('_pack_batches',),
+    'rebuild': ('_rebuild_cell',),
+    'postprocess': ('_postprocess',),
+}
+
+# Metrics compared against the baseline, where a larger value is a regression
+COMPARED_METRICS = ('segments', 'requests', 'characters', 'wall_time', 'cpu_time', 'peak_memory')
+
+
+def _sentence(rng, num_words):
+    return ' '.join(rng.choice(WORDS) for _ in range(num_words)).capitalize() + '.'
+
+
+def _markdown_lines(rng, shape, num_lines):
+    if shape == 'mixed':
+        return [line for i in range(num_lines) for line in _markdown_lines(rng, SHAPES[i % (len(SHAPES) - 1)], 1)]
+    lines = []
+    for i in range(num_lines):
+        if shape == 'short':
+            lines.append(_sentence(rng, rng.randint(3, 12)) + '\n')
+        elif shape == 'long':
+            lines.append(' '.join(_sentence(rng, rng.randint(8, 20)) for _ in range(150)) + '\n')
+        elif shape == 'code':
+            lines.extend(['```python\n', 'def f(x):\n', '    return x * 2\n', '```\n', _sentence(rng, 8) + ' `f(x)` ' + _sentence(rng, 5) + '\n'])
+        elif shape == 'images':
+            lines.append('{} ![figure_{}.png](attachment:figure_{}.png) {}\n'.format(_sentence(rng, 6), i, i, _sentence(rng, 6)))
+        elif shape == 'math':
+            lines.extend(['{} $\\hat{{y}} = W x_{} + b$ {}\n'.format(_sentence(rng, 6), i, _sentence(rng, 4)),
+                          '\\begin{equation}\n', 'L = \\sum_i (y_i - \\hat{y}_i)^2\n', '\\end{equation}\n'])
+    return lines
+
+
+def generate_notebook(shape, cells=200, lines_per_cell=20, seed=0):
+    # Synthetic notebook alternating markdown cells of the given shape and code cells with a base64 image output.
+    rng = random.Random(seed)
+    notebook_cells = []
+    for i in range(cells):
+        if i % 2 == 0:
+            notebook_cells.append({'cell_type': 'markdown', 'metadata': {},
+                                   'source': _markdown_lines(rng, shape, lines_per_cell)})
+        else:
+            notebook_cells.append({'cell_type': 'code', 'execution_count': i, 'metadata': {},
+                                   'source': ['import numpy as np\n', 'np.zeros({})'.format(i)],
+                                   'outputs': [{'output_type': 'display_data', 'metadata': {},
+                                                'data': {'image/png': 'iVBORw0KGgo' * 2000}}]})
+    return {'cells': notebook_cells, 'metadata': {}, 'nbformat': 4, 'nbformat_minor': 5}
+
+
+def _instrument(nb_translator, stage_times):
+    # Wraps the methods of each stage on the instance to accumulate their CPU time.
+    for stage, method_names in STAGE_METHODS.items():
+        for method_name in method_names:
+            method = getattr(nb_translator, method_name)
+
+            @functools.wraps(method)
+            def timed(*args, _method=method, _stage=stage, **kwargs):
+                start = time.process_time()
+                try:
+                    return _method(*args, **kwargs)
+                finally:
+                    stage_times[_stage] += time.process_time() - start
+
+            setattr(nb_translator, method_name, timed)
+
+
+def run_scenario(shape, cells=200, lines_per_cell=20, latency=0.02, max_concurrency=10, trace_memory=False,
+                 requests_per_minute=None, characters_per_minute=None, **run_options):
+    # The rate limits are off unless given, so that the wall time measures the pipeline rather than the quota sleeps.
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source_file = os.path.join(tmpdir, '{}.ipynb'.format(shape))
+        with open(source_file, 'w', encoding='utf-8') as f:
+            json.dump(generate_notebook(shape, cells, lines_per_cell), f)
+
+        backend = LocalTranslationBackend(latency=latency)
+        nb_translator = NbTranslator(backend=backend)
+        stage_times = {stage: 0.0 for stage in STAGE_METHODS}
+        _instrument(nb_translator, stage_times)
+
+        if trace_memory:
+            tracemalloc.start()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                asyncio.run(nb_translator.run(source_file, to='ja', max_concurrency=max_concurrency,
+                                              requests_per_minute=requests_per_minute,
+                                              characters_per_minute=characters_per_minute, **run_options))
+            finally:
+                sys.stdout = stdout
+        result = {
+            'shape': shape,
+            'source_bytes': os.path.getsize(source_file),
+            'target_bytes': os.path.getsize(os.path.join(tmpdir, 'ja_{}.ipynb'.format(shape))),
+            'segments': backend.segments,
+            'requests': backend.requests,
+            'characters': backend.characters,
+            'wall_time': time.perf_counter() - wall_start,
+            'cpu_time': time.process_time() - cpu_start,
+            'stage_cpu_time': stage_times,
+        }
+        if trace_memory:
+            result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return result
+
+
+def compare(results, baseline, tolerance):
+    # Returns the regressions as (shape, metric, baseline value, current value)
+    regressions = []
+    for shape, result in results.items():
+        for metric in COMPARED_METRICS:
+            base_value = baseline.get(shape, {}).get(metric)
+            value = result.get(metric)
+            if base_value is None or value is None:
+                continue
+            # Counts must not grow at all, timings and memory may vary within the tolerance
+            allowed = base_value if metric in ('segments', 'requests', 'characters') else base_value * (1 + tolerance)
+            if value > allowed:
+                regressions.append((shape, metric, base_value, value))
+    return regressions
+
+
+def main(shapes=SHAPES, cells=200, lines_per_cell=20, latency=0.02, max_concurrency=10, memory=True,
+         output=None, baseline=None, save_baseline=None, tolerance=0.2, **run_options):
+    # Extra options, e.g. --join_paragraphs or --pipeline, are passed to NbTranslator.run.
+    if isinstance(shapes, str):
+        shapes = shapes.split(',')
+    results = {}
+    for shape in shapes:
+        result = run_scenario(shape, cells, lines_per_cell, latency, max_concurrency, **run_options)
+        if memory:
+            # Measured in a separate run, since tracing allocations slows everything down
+            result['peak_memory'] = run_scenario(shape, cells, lines_per_cell, 0, max_concurrency, trace_memory=True,
+                                                 **run_options)['peak_memory']
+        results[shape] = result
+        print('{shape:>8}: {segments} segments, {requests} requests, {characters} characters, '
+              '{source_bytes} -> {target_bytes} bytes, wall {wall_time:.3f}s, cpu {cpu_time:.3f}s'.format(**result))
+        print('{:>8}  stage cpu: {}'.format('', ', '.join('{} {:.3f}s'.format(k, v) for k, v in result['stage_cpu_time'].items())))
+        if 'peak_memory' in result:
+            print('{:>8}  peak memory: {:.1f} MiB'.format('', result['peak_memory'] / 2**20))
+
+    for path in (output, save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=4)
+
+    if baseline:
+        with open(baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), tolerance)
+        for shape, metric, base_value, value in regressions:
+            print('REGRESSION {} {}: {} -> {}'.format(shape, metric, base_value, value))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against {}'.format(baseline))
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -0,0 +1,54 @@
+"""Microbenchmark of NbTranslator._postprocess against the chained passes it replaces.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_postprocess --segments 50000
+"""
+import random
+import timeit
+
+import fire
+
+from src.backends import LocalTranslationBackend
+from src.nb_translator import NbTranslator
+
+TOKENS = ('the', 'model', 'returns', 'データ', 'を', '学習', '（x）', '&#39;q&#39;', '&quot;z&quot;', '] (', '[link] (url)',
+          '* italic *', '** bold **', '$ x + y $', 'a / b', '<span translate="no">0</span>')
+
+
+def generate_segments(segments, plain_ratio=0.5, seed=0):
+    # Half of the segments are plain text without any symbol, which is the common case.
+    rng = random.Random(seed)
+    plain_tokens = TOKENS[:6]
+    return [' '.join(rng.choice(plain_tokens if rng.random() < plain_ratio else TOKENS) for _ in range(rng.randint(5, 30)))
+            for _ in range(segments)]
+
+
+def chained_postprocess(nb_translator, text):
+    # The postprocessing before the single scan: every pass runs on every segment, then the slash fix.
+    if not text:
+        return text
+    text = nb_translator._remove_no_translate_tag(text)
+    text = nb_translator._fix_markdown_symbols(text)
+    text = nb_translator._trim_text_format_symbols(text)
+    text = nb_translator._trim_inline_math_equation(text)
+    return nb_translator.slash_re.sub('/', text)
+
+
+def main(segments=50000, repeat=5, plain_ratio=0.5):
+    nb_translator = NbTranslator(backend=LocalTranslationBackend())
+    texts = generate_segments(segments, plain_ratio)
+
+    expected = [chained_postprocess(nb_translator, t) for t in texts]
+    actual = [nb_translator._fix_slashes(nb_translator._postprocess(t)) for t in texts]
+    if actual != expected:
+        raise AssertionError('The single scan postprocessing differs from the chained passes')
+
+    chained = min(timeit.repeat(lambda: [chained_postprocess(nb_translator, t) for t in texts], number=1, repeat=repeat))
+    single = min(timeit.repeat(lambda: [nb_translator._fix_slashes(nb_translator._postprocess(t)) for t in texts],
+                               number=1, repeat=repeat))
+    print('{} segments: chained {:.3f}s, single scan {:.3f}s, speedup {:.2f}x'.format(segments, chained, single, chained / single))
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
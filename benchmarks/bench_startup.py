@@ -0,0 +1,66 @@
+"""Startup time of the nbtl command line, for invocations which should not load the Cloud Translation client.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_startup --repeat 10
+"""
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import fire
+
+NBTL = ['-m', 'src.nb_translator']
+
+# Arguments of the Python interpreter by scenario. The interpreter alone tells the time of Python from the time of nbtl.
+# {tmpdir} is a directory with sample.ipynb and a translation memory which has all of its segments in Japanese,
+# so the cached scenario sends nothing to the API.
+SCENARIOS = {
+    'interpreter': ['-c', 'pass'],
+    'help': NBTL + ['--help'],
+    'invalid_input': NBTL + ['{tmpdir}/sample.txt', '--to', 'ja', '--project_id', 'benchmark'],
+    'cached': NBTL + ['{tmpdir}/sample.ipynb', '--to', 'ja', '--project_id', 'benchmark', '--cache_file', '{tmpdir}/tm.sqlite'],
+}
+
+
+def _prepare(tmpdir):
+    shutil.copy(os.path.join('tests', 'sample.ipynb'), os.path.join(tmpdir, 'sample.ipynb'))
+    subprocess.run([sys.executable] + NBTL + [os.path.join(tmpdir, 'sample.ipynb'), '--to', 'ja',
+                    '--backend', 'local', '--cache_file', os.path.join(tmpdir, 'tm.sqlite')],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_scenario(args, repeat=10):
+    # Returns the wall times of each invocation, in seconds
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=dict(os.environ, PAGER='cat'))
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main(scenarios=tuple(SCENARIOS), repeat=10, output=None):
+    if isinstance(scenarios, str):
+        scenarios = scenarios.split(',')
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _prepare(tmpdir)
+        for name in scenarios:
+            times = run_scenario([arg.format(tmpdir=tmpdir) for arg in SCENARIOS[name]], repeat)
+            results[name] = {'min': min(times), 'median': statistics.median(times)}
+            print('{:>14}: min {:.1f} ms, median {:.1f} ms'.format(name, results[name]['min'] * 1000,
+                                                                  results[name]['median'] * 1000))
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -8,9 +8,14 @@ setup(
     url='https://github.com/takumiohym/nb_translator',
     packages=find_packages(),
     install_requires=["fire", "google-cloud-translate"],
+    extras_require={
+        # Faster parsing of the notebooks
+        "fast": ["orjson"],
+    },
     entry_points={
         "console_scripts": [
             "nbtl = src.nb_translator:main",
+            "nbtl-submit = src.client:main",
         ]
     }
 )
@@ -0,0 +1,143 @@
+import asyncio
+import random
+import time
+
+
+class TranslationBackend():
+    # Interface of the translation engines used by NbTranslator.
+    # max_codepoints and max_segments are the limits of a single request to the engine.
+    max_codepoints = 30720
+    max_segments = 1024
+
+    async def translate(self, texts, source_language, target_language, mime_type):
+        # Returns the translations of texts, in the same order.
+        raise NotImplementedError
+
+
+class GcpTranslationBackend(TranslationBackend):
+    # Cloud Translation API v3 through TranslationServiceAsyncClient.
+
+    def __init__(self, client, project_id, region):
+        self.client = client
+        self.project_id = project_id
+        self.region = region
+
+    async def translate(self, texts, source_language, target_language, mime_type):
+        request={
+            "parent": f"projects/{self.project_id}/locations/{self.region}",
+            "contents": texts,
+            "mime_type": mime_type,
+            "source_language_code": source_language,
+            "target_language_code": target_language,
+        }
+        target = await self.client.translate_text(request=request)
+        return [t.translated_text for t in target.translations]
+
+
+class LocalTranslationBackend(TranslationBackend):
+    # Deterministic offline stand-in for the API, to test and benchmark without network access or costs.
+    # Texts found in the dictionary are replaced, the others are pseudo-translated as "[ja] text".
+    # latency (seconds) is simulated per request, and failure_rate of the requests raise failure_exception,
+    # by default ServiceUnavailable of the API.
+
+    def __init__(self, dictionary=None, latency=0.0, failure_rate=0.0, failure_exception=None,
+                 seed=0, max_codepoints=30720, max_segments=1024):
+        self.dictionary = dictionary or {}
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_exception = failure_exception
+        self.random = random.Random(seed)
+        self.max_codepoints = max_codepoints
+        self.max_segments = max_segments
+
+        self.requests = 0
+        self.segments = 0
+        self.characters = 0
+        self.failures = 0
+
+    async def translate(self, texts, source_language, target_language, mime_type):
+        # Imported here like in NbTranslator, since google.api_core takes a large part of the startup time
+        from google.api_core import exceptions as api_exceptions
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            self.failures += 1
+            raise (self.failure_exception or api_exceptions.ServiceUnavailable)('Injected failure of the local translation backend')
+        if len(texts) > self.max_segments or sum(len(t) for t in texts) > self.max_codepoints:
+            raise api_exceptions.InvalidArgument('Request exceeds the limits of the local translation backend')
+
+        self.requests += 1
+        self.segments += len(texts)
+        self.characters += sum(len(t) for t in texts)
+        return [self.dictionary.get(t, '[{}] {}'.format(target_language, t)) for t in texts]
+
+
+class TranslationEndpoint():
+    # A translation engine with its own concurrency and rate budget (a RequestScheduler), e.g. a project and region
+    # of the API, see ShardedTranslationBackend. The share of the requests of an endpoint grows with its weight.
+
+    def __init__(self, backend, scheduler, weight=1.0, name=None):
+        if weight <= 0:
+            raise ValueError('The weight of an endpoint must be positive. Provided: {}'.format(weight))
+        self.backend = backend
+        self.scheduler = scheduler
+        self.weight = weight
+        self.name = name
+        # Requests waiting or in flight, and time until which the endpoint is avoided after throttling
+        self.pending = 0
+        self.throttled_until = 0.0
+
+        self.requests = 0
+        self.characters = 0
+        self.throttles = 0
+
+
+class ShardedTranslationBackend(TranslationBackend):
+    # Spreads the requests across several endpoints to add up their quotas. Each request goes to the endpoint with
+    # the fewest pending requests for its weight. An endpoint which throttles a request (throttling_exceptions,
+    # by default ResourceExhausted of the API) is avoided for throttle_cooldown seconds and the request moves to
+    # another endpoint. When all of them throttle, the error is raised, and NbTranslator retries it with backoff.
+
+    def __init__(self, endpoints, throttle_cooldown=10.0, throttling_exceptions=None):
+        if not endpoints:
+            raise ValueError('At least one endpoint must be given.')
+        self.endpoints = list(endpoints)
+        self.throttle_cooldown = throttle_cooldown
+        self.throttling_exceptions = throttling_exceptions
+        # A request must fit every endpoint
+        self.max_codepoints = min(e.backend.max_codepoints for e in self.endpoints)
+        self.max_segments = min(e.backend.max_segments for e in self.endpoints)
+
+    def _select_endpoint(self, excluded):
+        # Endpoints which are not throttled come first, then the least loaded for their weight,
+        # then those which have used the least of their share of the requests so far
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e not in excluded]
+        return min(candidates, key=lambda e: (e.throttled_until > now, e.pending / e.weight, e.requests / e.weight))
+
+    async def translate(self, texts, source_language, target_language, mime_type):
+        throttling_exceptions = self.throttling_exceptions
+        if throttling_exceptions is None:
+            from google.api_core import exceptions as api_exceptions
+            throttling_exceptions = api_exceptions.ResourceExhausted
+
+        characters = sum(len(t) for t in texts)
+        tried = []
+        while True:
+            endpoint = self._select_endpoint(tried)
+            endpoint.pending += 1
+            try:
+                async with endpoint.scheduler.slot(characters):
+                    translated_texts = await endpoint.backend.translate(texts, source_language, target_language, mime_type)
+            except throttling_exceptions:
+                endpoint.throttles += 1
+                endpoint.throttled_until = time.monotonic() + self.throttle_cooldown
+                tried.append(endpoint)
+                if len(tried) == len(self.endpoints):
+                    raise
+                continue
+            finally:
+                endpoint.pending -= 1
+            endpoint.requests += 1
+            endpoint.characters += characters
+            return translated_texts
@@ -0,0 +1,46 @@
+import json
+import os
+import urllib.error
+import urllib.request
+
+import fire
+
+# Options which are paths, made absolute since the server may run in another directory
+PATH_OPTIONS = ('source_file', 'target_file', 'report_file', 'prometheus_file')
+
+
+def _absolute(path):
+    if isinstance(path, (list, tuple)):
+        return [_absolute(p) for p in path]
+    return os.path.abspath(os.path.expanduser(path))
+
+
+def submit(source_file, url='http://127.0.0.1:8765', **options):
+    # nbtl-submit: sends a job to a server started with "nbtl serve" and waits for it to finish.
+    # Takes the same options as nbtl, except the ones which are set by the server (e.g. project_id or cache_file).
+    # This module does not import the translator, so it starts quickly.
+    options['source_file'] = source_file
+    for option in PATH_OPTIONS:
+        if options.get(option) is not None:
+            options[option] = _absolute(options[option])
+
+    request = urllib.request.Request(url.rstrip('/') + '/translate', data=json.dumps(options).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(request) as response:
+            result = json.load(response)
+    except urllib.error.HTTPError as e:
+        raise RuntimeError('Translation job failed: {}'.format(json.load(e).get('error')))
+    except urllib.error.URLError as e:
+        raise RuntimeError('Could not reach the translation server at {}: {}'.format(url, e.reason))
+
+    source_files = result['report']['source_files']
+    print('Translated {} notebook(s) in {:.2f}s: {}'.format(len(source_files), result['seconds'], ', '.join(source_files)))
+
+
+def main():
+    fire.Fire(submit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import json
+import os
+import time
+
+
+class TranslationJournal():
+    # Append-only journal of the translations received during a run, so that an interrupted run can be resumed
+    # without sending the completed requests again. The first line identifies the run (e.g. the source files,
+    # the languages and the preprocessing options), and each following line holds the texts and translations
+    # of a completed request. Entries are keyed by the text like in TranslationMemory, since requests are
+    # deduplicated and packed across notebooks.
+    # Each line is flushed as it is written, so it survives a crash or Ctrl-C of the process. fsync, which also
+    # protects against a crash of the system, is batched to at most once every fsync_interval seconds.
+
+    def __init__(self, filepath, run_key, resume=False, fsync_interval=1.0):
+        self.filepath = filepath
+        self.run_key = run_key
+        self.fsync_interval = fsync_interval
+        # Translations replayed from the journal, by target language
+        self.translations = {}
+        self.replayed = 0
+
+        if resume and os.path.exists(filepath):
+            self.resumed = self._load()
+        else:
+            self.resumed = False
+        if self.resumed:
+            self.file = open(filepath, 'a', encoding='utf-8')
+        else:
+            self.file = open(filepath, 'w', encoding='utf-8')
+            self.file.write(json.dumps(run_key, ensure_ascii=False) + '\n')
+            self.file.flush()
+        self.synced_at = time.monotonic()
+
+    def _load(self):
+        # Returns whether the journal belongs to the same run. A line cut by a crash is skipped.
+        with open(self.filepath, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        try:
+            if json.loads(lines[0]) != self.run_key:
+                return False
+        except ValueError:
+            return False
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            translations = self.translations.setdefault(entry['target_language'], {})
+            translations.update(zip(entry['texts'], entry['translated_texts']))
+        # A cut line is ended, so that the next entry starts on its own line
+        if lines[-1]:
+            with open(self.filepath, 'a', encoding='utf-8') as f:
+                f.write('\n')
+        return True
+
+    def get_many(self, texts, target_language):
+        # Returns a list aligned with texts; None marks a text which is not in the journal.
+        translations = self.translations.get(target_language, {})
+        results = [translations.get(t) for t in texts]
+        self.replayed += sum(1 for r in results if r is not None)
+        return results
+
+    def append(self, texts, translated_texts, target_language):
+        if not texts:
+            return
+        entry = {'target_language': target_language, 'texts': texts, 'translated_texts': translated_texts}
+        self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.file.flush()
+        if time.monotonic() - self.synced_at >= self.fsync_interval:
+            self._sync()
+
+    def _sync(self):
+        os.fsync(self.file.fileno())
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.flush()
+            self._sync()
+            self.file.close()
+
+    def remove(self):
+        # Called once the run is complete and its results are written. The journal may already be gone,
+        # e.g. removed by hand or by another run given the same journal file.
+        self.close()
+        try:
+            os.remove(self.filepath)
+        except FileNotFoundError:
+            pass
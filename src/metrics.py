@@ -0,0 +1,102 @@
+import time
+from contextlib import contextmanager
+
+
+class RunMetrics():
+    # Collects the timings and counts of a translation run.
+    # Stages may be nested (e.g. preprocess runs inside segmentation), so their times do not add up.
+
+    # Upper bounds of the request latency histogram buckets, in seconds
+    latency_buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+    def __init__(self, per_cell=False):
+        self.per_cell = per_cell
+        self.stages = {}
+        self.counters = {
+            'segments': 0,
+            'characters': 0,
+            'requests': 0,
+            'request_segments': 0,
+            'request_characters': 0,
+            'retries': 0,
+            'failed_requests': 0,
+            # Identical segments translated once, see NbTranslator._translate_batch
+            'duplicate_segments': 0,
+            'duplicate_characters': 0,
+        }
+        self.latency_counts = [0] * len(self.latency_buckets)
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.cells = []
+
+    @contextmanager
+    def stage(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0})
+            stage['wall_seconds'] += time.perf_counter() - wall_start
+            stage['cpu_seconds'] += time.process_time() - cpu_start
+            stage['calls'] += 1
+
+    def increment(self, name, value=1):
+        self.counters[name] += value
+
+    def observe_request(self, latency, segments, characters):
+        self.counters['requests'] += 1
+        self.counters['request_segments'] += segments
+        self.counters['request_characters'] += characters
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        for i, upper_bound in enumerate(self.latency_buckets):
+            if latency <= upper_bound:
+                self.latency_counts[i] += 1
+                break
+
+    def record_cell(self, notebook_idx, cell_idx, lines, texts):
+        self.counters['segments'] += len(texts)
+        self.counters['characters'] += sum(len(t) for t in texts)
+        if self.per_cell:
+            self.cells.append({'notebook': notebook_idx, 'cell': cell_idx, 'lines': lines,
+                               'segments': len(texts), 'characters': sum(len(t) for t in texts)})
+
+    def to_dict(self):
+        report = {
+            'stages': self.stages,
+            'counters': self.counters,
+            'request_latency': {
+                'buckets': {('+Inf' if b == float('inf') else str(b)): c for b, c in zip(self.latency_buckets, self.latency_counts)},
+                'sum_seconds': self.latency_sum,
+                'max_seconds': self.latency_max,
+                'count': sum(self.latency_counts),
+            },
+        }
+        if self.per_cell:
+            report['cells'] = self.cells
+        return report
+
+    def to_prometheus(self, prefix='nbtl'):
+        # Prometheus text exposition format, e.g. for the node exporter textfile collector.
+        lines = [f'# TYPE {prefix}_stage_wall_seconds gauge',
+                 f'# TYPE {prefix}_stage_cpu_seconds gauge']
+        for name, stage in self.stages.items():
+            lines.append(f'{prefix}_stage_wall_seconds{{stage="{name}"}} {stage["wall_seconds"]}')
+            lines.append(f'{prefix}_stage_cpu_seconds{{stage="{name}"}} {stage["cpu_seconds"]}')
+        for name, value in self.counters.items():
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total {value}')
+        lines.append(f'# TYPE {prefix}_request_latency_seconds histogram')
+        cumulative = 0
+        for upper_bound, count in zip(self.latency_buckets, self.latency_counts):
+            cumulative += count
+            le = '+Inf' if upper_bound == float('inf') else str(upper_bound)
+            lines.append(f'{prefix}_request_latency_seconds_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f'{prefix}_request_latency_seconds_sum {self.latency_sum}')
+        lines.append(f'{prefix}_request_latency_seconds_count {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filepath):
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
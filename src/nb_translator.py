@@ -1,21 +1,92 @@
+import glob
+import multiprocessing
 import json
 import re
 import os
-import fire
+import sys
 import asyncio
+import bisect
+import copy
+import itertools
+import random
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
 
-from google.cloud import translate
-from google.cloud.translate_v3.services.translation_service import TranslationServiceAsyncClient
-import google.auth
+from .backends import (GcpTranslationBackend, LocalTranslationBackend, ShardedTranslationBackend, TranslationBackend,
+                       TranslationEndpoint)
+from .metrics import RunMetrics
+from .notebook_io import read_notebook, write_notebook
+from .scheduler import RequestScheduler
+from .journal import TranslationJournal
+from .translation_memory import TranslationMemory
+
+# The Cloud Translation client and google.auth take most of the startup time, so they are only imported when the API
+# is used, and fire only by main (e.g. the worker processes import this module). Set by create_translate_client.
+TranslationServiceAsyncClient = None
+
+def create_translate_client():
+    global TranslationServiceAsyncClient
+    if TranslationServiceAsyncClient is None:
+        from google.cloud.translate_v3.services.translation_service import TranslationServiceAsyncClient
+    return TranslationServiceAsyncClient()
+
+class _LineInfo():
+    # Information about a line of a markdown cell, to rebuild the cell once its texts are translated.
+    # Slots keep the millions of lines of large notebook sets small, and the defaults are shared by the untranslated lines.
+    __slots__ = ('original_line', 'prefix', 'content_to_translate', 'suffix', 'translate', 'placeholders', 'joined_lines', 'joined')
+
+    def __init__(self, original_line):
+        self.original_line = original_line
+        self.prefix = ''
+        # The texts of a translated line, split by length, or '' for the other lines
+        self.content_to_translate = ''
+        self.suffix = ''
+        self.translate = False
+        # Original text of the protected spans of the line, see _preprocess
+        self.placeholders = ()
+        # Set by _join_paragraph_lines: the number of lines joined into this line,
+        # and whether this line is translated as part of a previous line
+        self.joined_lines = 1
+        self.joined = False
 
 class NbTranslator():
 
-    def __init__(self):
+    def __init__(self, backend=None, translate_client=None, request_scheduler=None):
         self.no_translate_start_tag = '<span translate="no">'
         self.no_translate_end_tag = '</span>'
         self.no_translate_start_tag_re = re.compile(self.no_translate_start_tag)
         self.no_translate_end_tag_re = re.compile(self.no_translate_end_tag)
-        self.image_placeholders = {}
+
+        # For _preprocess: markdown spans which are not translated, found in a single scan of each line. Each alternative
+        # is its first character followed by a group named by the kind of span. The alternatives starting with a literal
+        # character let the regular expression engine skip to the positions of those characters, and each alternative
+        # stops at the first possible closing symbol, so the scan stays linear in the length of the line.
+        # Raw HTML needs no protection, since the API keeps the tags of text/html.
+        self.protected_span_patterns = [
+            ('code', '`', r'(?P<code>(?P<backticks>`*)[^`]+`(?P=backticks))'),
+            ('image', '!', r'(?P<image>\[[^\]\n]*\]\([^)\n]*\))'),
+            ('display_math', '$', r'(?P<display_math>\$[^$]+\$\$)'),
+            ('inline_math', '$', r'(?P<inline_math>(?=\S)[^$\n]*(?<=\S)\$(?!\d))'),
+            ('link_target', '(', r'(?P<link_target>(?<=\]\()[^()\s]+(?:\s+"[^"\n]*")?\))'),
+            ('url', 'h', r'(?P<url>ttps?://[^\s<>()\[\]"\'`]*[^\s<>()\[\]"\'`.,;:!?])'),
+            ('url', 'f', r'(?P<ftp_url>tp://[^\s<>()\[\]"\'`]*[^\s<>()\[\]"\'`.,;:!?])'),
+        ]
+        # Spans protected whatever the options. They are only replaced when longer than their placeholder,
+        # since the placeholder would send more characters than the span.
+        self.always_protected_spans = ('image', 'display_math', 'inline_math')
+        # Compiled patterns by (exclude_inline_code, exclude_url), see _protected_span_re
+        self.protected_span_res = {}
+        # First characters of the protected spans and of their placeholders
+        self.protected_span_first_chars = ''.join(first_char for _, first_char, _ in self.protected_span_patterns) + '<'
+        # Protected spans are sent as numbered placeholders in no-translate spans, e.g. <span translate="no">0</span>.
+        # After the translation, they are replaced by private use characters which postprocessing leaves untouched,
+        # then restored from the placeholders of their line.
+        self.placeholder_re = re.compile(r'{}\s*(\d+)\s*{}'.format(re.escape(self.no_translate_start_tag),
+                                                                   re.escape(self.no_translate_end_tag)))
+        self.hidden_placeholder_re = re.compile('\ue000(\\d+)\ue001')
+        self.exclude_inline_code = False
+        self.exclude_url = False
 
         # Matches lines starting with markdown symbols or only content.
         self.split_start_symbols_re = re.compile(r"([#|>|\-|\*|\d\.|\s]*\s)?(.*)(\n?)")
@@ -24,18 +95,132 @@ class NbTranslator():
         # For _trim_inline_math_equation
         self.inline_math_re = re.compile(r'\$(.*?)\$')
 
+        # For _postprocess: symbols to replace in a single scan, with the table built once
+        self.fullwidth_symbols_table = str.maketrans({
+            '（': '(',
+            '）': ')',
+        })
+        self.postprocess_symbols = {
+            self.no_translate_start_tag: '',
+            self.no_translate_end_tag: '',
+            '（': '(',
+            '）': ')',
+            '&#39;': "'",
+            '&quot;': '"',
+            '] (': '](',
+            '] （': '](',
+        }
+        self.postprocess_symbol_prefixes = {s[:i] for s in self.postprocess_symbols for i in range(1, len(s))}
+        self.longest_postprocess_symbol = max(len(s) for s in self.postprocess_symbols)
+        self.postprocess_symbols_re = re.compile('|'.join(re.escape(s) for s in self.postprocess_symbols))
+        # The symbols, and the text between each pair of "*" (or after the last unpaired one) which is trimmed like
+        # _trim_text_format_symbols does
+        self.postprocess_re = re.compile(r'\*(?P<emphasis>[^*]*)(?P<closing>\*|\Z)|' + self.postprocess_symbols_re.pattern)
+        self.strong_re = re.compile(r'\*\*(.*?)(\*\*|\Z)', re.DOTALL)
+        self.slash_re = re.compile(r"\s?/\s?")
+
         # To split the long line by the length, by default, 5000 which is the limit of the GCP Translation API
         self.split_by_length = 5000
+        # For _split_lines_by_length: lines are split after a sentence, then after a whitespace,
+        # and never inside markup such as tags or no-translate spans.
+        self.sentence_boundary_re = re.compile(r'[.!?]\s+|[。！？]\s*')
+        self.whitespace_boundary_re = re.compile(r'\s+')
+        self.markup_re = re.compile('{}.*?{}|<[^<>]*>'.format(re.escape(self.no_translate_start_tag),
+                                                              re.escape(self.no_translate_end_tag)))
         # To split the texts by the total codepoints, by default, 30720 which is the limit of the GCP Translation API
         self.split_by_codepoints = 30720
+        # Consecutive lines of a paragraph are joined into one segment with this tag with the join_paragraphs option
+        self.join_paragraphs = False
+        self.line_break_tag = '<br>'
+        self.line_break_re = re.compile(r'\s*<br\s*/?>\s*', re.IGNORECASE)
+        # To split the texts by the number of segments, by default, 1024 which is the limit of the GCP Translation API
+        self.max_segments_per_request = 1024
 
+        # Blocks which are not translated: fences of any language (closed by a fence of the same symbol, at least as long),
+        # math environments and the blocks given by their opening and closing lines in exclude_block_symbol_pair.
+        self.fence_re = re.compile(r'(`{3,}|~{3,})[^`]*')
+        self.begin_environment_re = re.compile(r'\\begin\{([^{}]+)\}')
         self.exclude_block_symbol_pair = {
-            '```python': '```', # Python syntax highlight
-            '```': '```', # General code block
-            '\\begin{equation}': '\\end{equation}' # Math equation block
+            '$$': '$$', # Display math block
         }
 
-        self.translate_client = TranslationServiceAsyncClient()
+        self.mime_type = "text/html"
+        # The original lines of each cell are kept in a comment block with the keep_source option
+        self.keep_source_start = "\n\n<!--\n"
+        self.keep_source_end = "\n -->\n"
+        # Number of markdown cells reused from the previous translation with the incremental option
+        self.reused_cell_count = 0
+        self.incremental = False
+        # Send requests while the notebooks are still being segmented, with the pipeline option
+        self.pipeline = False
+        # Number of processes segmenting and rebuilding the cells with the workers option, 0 to do it in this process.
+        # Each task of a worker has at most worker_chunk_cells cells.
+        self.workers = 0
+        self.worker_chunk_cells = 100
+        # With the dry_run option, the texts are segmented and packed but not sent, and no file is written.
+        # The characters of each request are kept to estimate the time of the run with dry_run_latency seconds per request.
+        self.dry_run = False
+        self.dry_run_latency = 1.0
+        self.dry_run_request_characters = []
+        # Language settings are configured per run in _initialize_settings
+        self.source_language = None
+        self.target_language = None
+        self.target_languages = []
+        # On-disk cache of previous translations, enabled with the cache_file option
+        self.translation_memory = None
+        # Append-only journal of the translations received during the current run, to resume it with the resume option
+        self.journal = None
+        # Limits the requests in flight and the request/character rates, configured per run in _initialize_run_options.
+        # A scheduler given to the constructor is shared with other translators (e.g. by the server) and kept as is.
+        self.shared_request_scheduler = request_scheduler is not None
+        self.request_scheduler = request_scheduler or RequestScheduler()
+        self.packing_stats = self._new_packing_stats()
+        # Timings and counts of the current run, see metrics.py.
+        # Each function in metrics_hooks is called with the run report at the end of run, e.g. to export it.
+        self.metrics = RunMetrics()
+        self.metrics_hooks = []
+
+        # Retry transient errors with jittered exponential backoff. A failed request is split in halves before retrying.
+        self.max_retries = 5
+        self.retry_base_delay = 1.0
+        self.retry_max_delay = 32.0
+        # By default, the transient errors of the API, see the retryable_exceptions property
+        self._retryable_exceptions = None
+
+        # Translation engine, see backends.py. By default, the Cloud Translation API through translate_client,
+        # which can be given to reuse a client which is already connected.
+        self.backend = backend
+        self._translate_client = translate_client
+        # Project and region endpoints which share the requests with the endpoints option, see _parse_endpoints.
+        # Their ShardedTranslationBackend is built on the first request.
+        self.endpoints = []
+        self.sharded_backend = None
+
+    @property
+    def translate_client(self):
+        # Created on the first request, so that e.g. --help, invalid inputs and fully cached runs do not pay for it
+        if self._translate_client is None:
+            self._translate_client = create_translate_client()
+        return self._translate_client
+
+    @translate_client.setter
+    def translate_client(self, translate_client):
+        self._translate_client = translate_client
+
+    @property
+    def retryable_exceptions(self):
+        if self._retryable_exceptions is None:
+            from google.api_core import exceptions as api_exceptions
+            self._retryable_exceptions = (
+                api_exceptions.ResourceExhausted,
+                api_exceptions.ServiceUnavailable,
+                api_exceptions.DeadlineExceeded,
+            )
+        return self._retryable_exceptions
+
+    @retryable_exceptions.setter
+    def retryable_exceptions(self, retryable_exceptions):
+        self._retryable_exceptions = retryable_exceptions
 
     def _split_start_symbols(self, text):
         # Match only if the sentense start with these symbols and space after them.
@@ -50,55 +235,179 @@ class NbTranslator():
             return ('', groups[1], groups[2])
         return groups
 
-    def _exclude_code_highlight(self, text):
-        # Exclude code highlights in markdown from translation.
-        # `(.*?)` will match any characters between two backticks (non-greedy).
-        # \g<0> in the replacement refers to the entire match (i.e., `content_inside_backticks`).
-        return re.sub(r'`(.*?)`',
-                      f'{self.no_translate_start_tag}\\g<0>{self.no_translate_end_tag}',
-                      text)
+    def _protect_span(self, match, placeholders):
+        span = match.group()
+        placeholder = '{}{}{}'.format(self.no_translate_start_tag, len(placeholders), self.no_translate_end_tag)
+        if len(span) <= len(placeholder) and match.lastgroup in self.always_protected_spans:
+            return span
+        placeholders.append(span)
+        return placeholder
 
-    # TODO
-    def _exclude_url(self, text):
-        return text
+    def _hide_placeholders(self, text):
+        return self.placeholder_re.sub('\ue000\\1\ue001', text)
 
-    def _exclude_image_tag(self, text):
-        self.image_placeholders = {}
+    def _restore_spans(self, text, placeholders):
         def replacer(match):
-            placeholder = f"__IMAGE_PLACEHOLDER_{len(self.image_placeholders)}__"
-            self.image_placeholders[placeholder] = match.group(0)
-            return f'{self.no_translate_start_tag}{placeholder}{self.no_translate_end_tag}'
+            index = int(match.group(1))
+            # A placeholder which did not come from this line (e.g. made up by the engine) is kept as its number
+            return placeholders[index] if index < len(placeholders) else match.group(1)
+        return self.hidden_placeholder_re.sub(replacer, text)
 
-        return re.sub(r'!\[(.*?)\]\((.*?)\)', replacer, text)
+    def _block_end_re(self, stripped_line):
+        # Returns a pattern matching the closing line of the block opened by this line, or None if it opens no block.
+        m = self.fence_re.fullmatch(stripped_line)
+        if m:
+            fence = m.group(1)
+            return re.compile('{}{{{},}}'.format(re.escape(fence[0]), len(fence)))
+        m = self.begin_environment_re.fullmatch(stripped_line)
+        if m:
+            return re.compile(re.escape('\\end{{{}}}'.format(m.group(1))))
+        if stripped_line in self.exclude_block_symbol_pair:
+            return re.compile(re.escape(self.exclude_block_symbol_pair[stripped_line]))
+        return None
+
+    def _is_grapheme_boundary(self, text, pos):
+        # Approximates grapheme cluster boundaries: do not split before combining marks, variation selectors,
+        # emoji modifiers and zero width joiners, nor after a zero width joiner.
+        ch = text[pos]
+        if unicodedata.combining(ch) or unicodedata.category(ch) in ('Mn', 'Me', 'Mc'):
+            return False
+        if '\ufe00' <= ch <= '\ufe0f' or '\U0001f3fb' <= ch <= '\U0001f3ff' or ch == '\u200d':
+            return False
+        return text[pos - 1] != '\u200d'
 
     def _split_lines_by_length(self, text):
         if not text or len(text) <= self.split_by_length:
             return [text]
 
-        return [text[i:i+self.split_by_length] for i in range(0, len(text), self.split_by_length)]
+        limit = self.split_by_length
+        markup_spans = [m.span() for m in self.markup_re.finditer(text)]
+        markup_starts = [start for start, _ in markup_spans]
+        boundaries = ([m.end() for m in self.sentence_boundary_re.finditer(text)],
+                      [m.end() for m in self.whitespace_boundary_re.finditer(text)])
+
+        def enclosing_markup_start(pos):
+            # Returns the start of the markup which contains pos, or None
+            i = bisect.bisect_left(markup_starts, pos) - 1
+            if i >= 0 and markup_spans[i][0] < pos < markup_spans[i][1]:
+                return markup_spans[i][0]
+            return None
 
-    def _preprocess(self, text):
+        def find_cut(start):
+            end = start + limit
+            # Only cut at sentence or whitespace boundaries which fill at least half of the chunk
+            min_end = start + limit // 2
+            for cuts in boundaries:
+                i = bisect.bisect_right(cuts, end) - 1
+                while i >= 0 and cuts[i] > min_end:
+                    markup_start = enclosing_markup_start(cuts[i])
+                    if markup_start is None:
+                        return cuts[i]
+                    i = bisect.bisect_right(cuts, markup_start) - 1
+
+            cut = end
+            markup_start = enclosing_markup_start(cut)
+            if markup_start is not None and markup_start > start:
+                return markup_start
+            while cut > start + 1 and not self._is_grapheme_boundary(text, cut):
+                cut -= 1
+            return cut
+
+        chunks = []
+        start = 0
+        while len(text) - start > limit:
+            cut = find_cut(start)
+            chunks.append(text[start:cut])
+            start = cut
+        chunks.append(text[start:])
+        return chunks
+
+    def _preprocess(self, text, placeholders=None):
+        # Replaces the protected spans of the line by placeholders, and appends their original text to placeholders.
+        # Images and math are always protected. Inline code is protected with the exclude_inline_code option,
+        # disabled by default since it affects the quality of the translation, and link targets and URLs with exclude_url.
         if not text:
             return text
+        if placeholders is None:
+            placeholders = []
+        protected_span_re = self.protected_span_res.get((self.exclude_inline_code, self.exclude_url)) or self._protected_span_re()
+        return protected_span_re.sub(lambda m: self._protect_span(m, placeholders), text)
 
-        if self.exclude_inline_code: # disabled by default, since enabling this affects on the quality of translation
-            text = self._exclude_code_highlight(text)
-        if self.exclude_url:
-            text = self._exclude_url(text)
+    def _only_protected_spans(self, text):
+        # Whether the text only has protected spans, replaced by placeholders or kept as they are when shorter
+        if text.lstrip()[:1] not in self.protected_span_first_chars:
+            return False
+        return not self._protected_span_re().sub('', self.placeholder_re.sub('', text)).strip()
 
-        text = self._exclude_image_tag(text)
-        return text
+    def _protected_span_re(self):
+        # Only the spans protected with the current options are matched, so that the others cost nothing.
+        key = (self.exclude_inline_code, self.exclude_url)
+        if key not in self.protected_span_res:
+            kinds = set(self.always_protected_spans)
+            if self.exclude_inline_code:
+                kinds.add('code')
+            if self.exclude_url:
+                kinds.update(('link_target', 'url'))
+            self.protected_span_res[key] = re.compile('|'.join(
+                re.escape(first_char) + pattern for kind, first_char, pattern in self.protected_span_patterns if kind in kinds))
+        return self.protected_span_res[key]
 
-    async def _translate(self, texts):
-        request={
-            "parent": f"projects/{self.project_id}/locations/{self.region}",
-            "contents": texts,
-            "mime_type": "text/html",
-            "source_language_code": self.source_language,
-            "target_language_code": self.target_language,
-        }
-        target = await self.translate_client.translate_text(request=request)
-        return [t.translated_text for t in target.translations]
+    def _get_backend(self):
+        if self.endpoints:
+            if self.sharded_backend is None:
+                self.sharded_backend = ShardedTranslationBackend([
+                    TranslationEndpoint(self._endpoint_backend(endpoint),
+                                        self._endpoint_scheduler(endpoint),
+                                        weight=endpoint['weight'],
+                                        name='{}/{}'.format(endpoint['project_id'], endpoint['region']))
+                    for endpoint in self.endpoints])
+            return self.sharded_backend
+        if self.backend is not None:
+            return self.backend
+        if self.project_id is None:
+            self.project_id = self._default_project_id()
+        return GcpTranslationBackend(self.translate_client, self.project_id, self.region)
+
+    def _endpoint_backend(self, endpoint):
+        # Each endpoint of the API has its own client. Another backend (e.g. local) stands in for all the endpoints.
+        if self.backend is not None:
+            return self.backend
+        if endpoint['project_id'] is None:
+            if self.project_id is None:
+                self.project_id = self._default_project_id()
+            endpoint['project_id'] = self.project_id
+        return GcpTranslationBackend(create_translate_client(), endpoint['project_id'], endpoint['region'])
+
+    def _endpoint_scheduler(self, endpoint):
+        return RequestScheduler(endpoint['max_concurrency'], endpoint['requests_per_minute'], endpoint['characters_per_minute'])
+
+    def _parse_endpoints(self, endpoints, max_concurrency, requests_per_minute, characters_per_minute):
+        # endpoints is a list of "project_id/region" (or a string of them separated by commas), or of dicts with
+        # project_id, region and optionally weight, max_concurrency, requests_per_minute and characters_per_minute.
+        # The limits default to those of the run, which then apply to each endpoint.
+        if not endpoints:
+            return []
+        if isinstance(endpoints, str):
+            endpoints = endpoints.split(',')
+        defaults = {'project_id': None, 'region': 'global', 'weight': 1.0, 'max_concurrency': max_concurrency,
+                    'requests_per_minute': requests_per_minute, 'characters_per_minute': characters_per_minute}
+        parsed = []
+        for endpoint in endpoints:
+            if isinstance(endpoint, str):
+                project_id, _, region = endpoint.strip().partition('/')
+                endpoint = {'project_id': project_id or None, 'region': region or 'global'}
+            unknown_keys = set(endpoint) - set(defaults)
+            if unknown_keys:
+                raise ValueError('Unknown endpoint options: {}'.format(', '.join(sorted(unknown_keys))))
+            endpoint = dict(defaults, **endpoint)
+            if endpoint['max_concurrency'] < 1:
+                raise ValueError('max_concurrency must be 1 or more. Provided: {}'.format(endpoint['max_concurrency']))
+            parsed.append(endpoint)
+        return parsed
+
+    async def _translate(self, texts, target_language=None):
+        return await self._get_backend().translate(texts, self.source_language, target_language or self.target_language,
+                                                   self.mime_type)
 
     def _remove_no_translate_tag(self, text):
         if not text:
@@ -110,13 +419,7 @@ class NbTranslator():
     def _fix_markdown_symbols(self, text):
         if not text:
             return text
-        # Using a dictionary for replacements can be cleaner if many replacements are planned.
-        # For now, direct chaining is fine.
-        table = str.maketrans({
-            '（': '(',
-            '）': ')',
-        })
-        text = text.translate(table)
+        text = text.translate(self.fullwidth_symbols_table)
         text = text.replace("&#39;", "'").replace("&quot;", '"').replace('] (', '](')
         return text
 
@@ -134,183 +437,924 @@ class NbTranslator():
             return text
         return self.inline_math_re.sub(lambda m: '$' + m.group(1).replace(' ', '') + '$', text)
 
-    def _restore_image_tags(self, text):
-        for placeholder, original_tag in self.image_placeholders.items():
-            text = text.replace(placeholder, original_tag)
-        return text
-
     def _postprocess(self, text):
         if not text: # Added guard clause for the whole postprocess
             return text
-        text = self._remove_no_translate_tag(text)
-        text = self._fix_markdown_symbols(text)
-        text = self._trim_text_format_symbols(text)
-        text = self._trim_inline_math_equation(text)
-        text = self._restore_image_tags(text)
+        # Same result as the chained _remove_no_translate_tag, _fix_markdown_symbols and _trim_text_format_symbols
+        self.formed_symbol = False
+        replaced_text = self.postprocess_re.sub(self._replace_postprocess_match, text)
+        if self.formed_symbol:
+            # Removing a tag may have formed another symbol (e.g. "&#<span translate="no">39;"), which the chained passes replace
+            text = self._trim_text_format_symbols(self._fix_markdown_symbols(self._remove_no_translate_tag(text)))
+        else:
+            text = replaced_text
+            # Then the pairs of "**" of the result, like the second step of _trim_text_format_symbols
+            if '**' in text:
+                text = self.strong_re.sub(lambda m: '**' + m.group(1).strip() + m.group(2), text)
+        if '$' in text:
+            text = self._trim_inline_math_equation(text)
         return text
 
-    def _initialize_settings(self, source_file, target_file, orig_lang, target_lang, project_id, region, exclude_inline_code, exclude_url):
+    def _fix_slashes(self, text):
+        # a / b -> a/b
+        if '/' not in text:
+            return text
+        return self.slash_re.sub('/', text)
+
+    def _replace_postprocess_match(self, match):
+        emphasis = match.group('emphasis')
+        if emphasis is None:
+            return self._replace_postprocess_symbol(match)
+        emphasis = self.postprocess_symbols_re.sub(self._replace_postprocess_symbol, emphasis)
+        return '*' + emphasis.strip() + match.group('closing')
+
+    def _replace_postprocess_symbol(self, match):
+        symbol = match.group()
+        if symbol in (self.no_translate_start_tag, self.no_translate_end_tag):
+            # Another symbol is formed when the text before the tag ends with the beginning of a symbol,
+            # which has a single "&", "<" or "]"
+            start = match.start()
+            text = match.string
+            for first_char in '&<]':
+                i = text.rfind(first_char, max(start - self.longest_postprocess_symbol, 0), start)
+                if i >= 0 and text[i:start] in self.postprocess_symbol_prefixes:
+                    self.formed_symbol = True
+        return self.postprocess_symbols[symbol]
+
+    def _cache_options(self):
+        # Preprocessing options which change the text sent to the API, used as part of the cache key.
+        return 'exclude_inline_code={:d},exclude_url={:d},join_paragraphs={:d}'.format(
+            bool(self.exclude_inline_code), bool(self.exclude_url), bool(self.join_paragraphs))
+
+    def _initialize_settings(self, source_file, target_file, orig_lang, target_lang, project_id, region, exclude_inline_code, exclude_url,
+                             cache_file=None, cache_size=100000, dry_run=False):
         self.source_file = source_file
         self.source_language = orig_lang
-        self.target_language = target_lang
+        # Several target languages can be given as "ja,ko" (or a tuple, which is how fire parses it)
+        self.target_languages = self._parse_target_languages(target_lang)
+        self.target_language = self.target_languages[0] if self.target_languages else None
         self.region = region
         self.project_id = project_id
         self.exclude_inline_code = exclude_inline_code
         self.exclude_url = exclude_url
 
         if target_file is None:
-            self.target_file = '{}/{}_{}'.format(os.path.dirname(os.path.realpath(self.source_file)),
-                                                self.target_language,
-                                                os.path.basename(self.source_file))
+            self.target_file = self._default_target_file(self.source_file, self.target_language)
         else:
             self.target_file = target_file
 
-        if self.project_id is None:
-            try:
-                _, self.project_id = google.auth.default()
-            except google.auth.exceptions.DefaultCredentialsError: # Be more specific with exception
-                raise RuntimeError('Default GCP Project ID is not set. '
-                                   'Please specify GCP project ID directly in project_id option, '
-                                   'or configure it following https://cloud.google.com/docs/authentication/getting-started')
-            except Exception as e: # Catch other potential auth errors
-                 raise RuntimeError(f'Could not retrieve default GCP Project ID: {e}. '
-                                   'Please specify GCP project ID directly in project_id option, '
-                                   'or configure it following https://cloud.google.com/docs/authentication/getting-started')
+        if cache_file is not None:
+            # A dry run only reads an existing translation memory
+            if not dry_run:
+                self.translation_memory = TranslationMemory(cache_file, max_entries=cache_size)
+            elif os.path.exists(cache_file):
+                self.translation_memory = TranslationMemory(cache_file, max_entries=cache_size, read_only=True)
+
+    def _default_project_id(self):
+        # The project is only needed for the Cloud Translation API, so it is looked up on the first request
+        import google.auth
+        try:
+            _, project_id = google.auth.default()
+        except google.auth.exceptions.DefaultCredentialsError: # Be more specific with exception
+            raise RuntimeError('Default GCP Project ID is not set. '
+                               'Please specify GCP project ID directly in project_id option, '
+                               'or configure it following https://cloud.google.com/docs/authentication/getting-started')
+        except Exception as e: # Catch other potential auth errors
+             raise RuntimeError(f'Could not retrieve default GCP Project ID: {e}. '
+                               'Please specify GCP project ID directly in project_id option, '
+                               'or configure it following https://cloud.google.com/docs/authentication/getting-started')
+        return project_id
+
+    def _initialize_run_options(self, max_concurrency, requests_per_minute, characters_per_minute, max_segments_per_request,
+                                max_retries, incremental, join_paragraphs, pipeline, per_cell_metrics=False, workers=0,
+                                dry_run=False, dry_run_latency=1.0, endpoints=None):
+        if max_concurrency < 1:
+            raise ValueError('max_concurrency must be 1 or more. Provided: {}'.format(max_concurrency))
+        if workers < 0:
+            raise ValueError('workers must be 0 or more. Provided: {}'.format(workers))
+        if workers and pipeline:
+            raise ValueError('workers cannot be combined with pipeline.')
+        self.endpoints = self._parse_endpoints(endpoints, max_concurrency, requests_per_minute, characters_per_minute)
+        self.sharded_backend = None
+        if not self.shared_request_scheduler:
+            if self.endpoints:
+                # Each endpoint has its own limits, see ShardedTranslationBackend
+                self.request_scheduler = RequestScheduler(sum(e['max_concurrency'] for e in self.endpoints))
+            else:
+                self.request_scheduler = RequestScheduler(max_concurrency, requests_per_minute, characters_per_minute)
+        # Requests never exceed the limits of the translation backend. Those of the API are known without its client.
+        backend = self.backend if self.backend is not None else GcpTranslationBackend
+        self.split_by_codepoints = min(self.split_by_codepoints, backend.max_codepoints)
+        self.max_segments_per_request = min(max_segments_per_request, backend.max_segments)
+        self.packing_stats = self._new_packing_stats()
+        self.max_retries = max_retries
+        self.incremental = incremental
+        self.reused_cell_count = 0
+        self.join_paragraphs = join_paragraphs
+        self.pipeline = pipeline
+        self.workers = workers
+        self.dry_run = dry_run
+        self.dry_run_latency = dry_run_latency
+        self.dry_run_request_characters = []
+        self.metrics = RunMetrics(per_cell=per_cell_metrics)
+
+    def _initialize_backend(self, backend):
+        # backend is 'gcp' for the Cloud Translation API or 'local' for the offline LocalTranslationBackend.
+        # None keeps the backend given to the constructor.
+        if backend is None:
+            return
+        if backend == 'gcp':
+            self.backend = None
+        elif backend == 'local':
+            self.backend = LocalTranslationBackend()
+        else:
+            raise ValueError('Unknown translation backend: {}. Use "gcp" or "local".'.format(backend))
+
+    def _parse_target_languages(self, target_lang):
+        if not target_lang:
+            return []
+        if isinstance(target_lang, str):
+            target_lang = target_lang.split(',')
+        target_languages = [str(lang).strip() for lang in target_lang]
+        return list(dict.fromkeys(lang for lang in target_languages if lang))
+
+    def _default_target_file(self, source_file, target_language):
+        return '{}/{}_{}'.format(os.path.dirname(os.path.realpath(source_file)),
+                                 target_language,
+                                 os.path.basename(source_file))
+
+    def _default_journal_file(self, source_file, target_file):
+        # Next to the output rather than the source, which may be read-only, and by target languages,
+        # so that concurrent runs of a notebook into other languages have their own journal.
+        return '{}/.{}.{}.journal'.format(os.path.dirname(os.path.realpath(target_file)),
+                                          os.path.basename(source_file),
+                                          '.'.join(self.target_languages))
+
+    def _open_journal(self, source_files, target_file, journal_file, resume):
+        # A dry run sends nothing, so it has nothing to journal
+        if self.dry_run:
+            self.journal = None
+            return
+        journal_file = journal_file or self._default_journal_file(source_files[0], target_file)
+        # The journal is only replayed by the same run, since the translations depend on the languages and options
+        run_key = {
+            'source_files': [os.path.realpath(f) for f in source_files],
+            'source_language': self.source_language,
+            'target_languages': self.target_languages,
+            'mime_type': self.mime_type,
+            'options': self._cache_options(),
+        }
+        self.journal = TranslationJournal(journal_file, run_key, resume=resume)
+        if resume and not self.journal.resumed:
+            print('No journal of this run in {}, translating from the start'.format(journal_file))
+
+    def _is_multiple_sources(self, source_file):
+        # A list of files, a directory or a glob pattern is translated as a batch of notebooks by run.
+        # A file whose name has glob characters (e.g. "lesson[1].ipynb") is a single notebook.
+        if isinstance(source_file, (list, tuple)):
+            return True
+        if os.path.isfile(source_file):
+            return False
+        return os.path.isdir(source_file) or glob.has_magic(source_file)
+
+    def _expand_source_files(self, source_files, target_languages):
+        if isinstance(source_files, str):
+            source_files = [source_files]
+
+        expanded = []
+        for source in source_files:
+            if os.path.isfile(source):
+                paths = [source]
+            elif os.path.isdir(source):
+                paths = glob.glob(os.path.join(glob.escape(source), '**', '*.ipynb'), recursive=True)
+            elif glob.has_magic(source):
+                paths = glob.glob(source, recursive=True)
+            else:
+                paths = [source]
+            expanded.extend(sorted(p for p in paths if '.ipynb_checkpoints' not in p.split(os.sep)))
+        expanded = list(dict.fromkeys(expanded))
+
+        # Skip the outputs of previous runs, i.e. "ja_foo.ipynb" next to "foo.ipynb".
+        expanded_set = set(expanded)
+        prefixes = ['{}_'.format(lang) for lang in self._parse_target_languages(target_languages)]
+        def is_previous_output(path):
+            basename = os.path.basename(path)
+            return any(basename.startswith(prefix) and
+                       os.path.join(os.path.dirname(path), basename[len(prefix):]) in expanded_set
+                       for prefix in prefixes)
+        return [p for p in expanded if not is_previous_output(p)]
+
+    def _run_report(self, source_files):
+        report = {
+            'source_files': list(source_files),
+            'target_languages': self.target_languages,
+            'packing': self.packing_stats,
+            'reused_cells': self.reused_cell_count,
+        }
+        if self.translation_memory is not None:
+            report['translation_memory'] = {'hits': self.translation_memory.hits, 'misses': self.translation_memory.misses}
+        if self.journal is not None:
+            report['journal'] = {'resumed': self.journal.resumed, 'replayed': self.journal.replayed}
+        endpoint_stats = self._endpoint_stats()
+        if endpoint_stats is not None:
+            report['endpoints'] = endpoint_stats
+        if self.dry_run:
+            report['dry_run'] = self._dry_run_estimate()
+        report.update(self.metrics.to_dict())
+        return report
+
+    def _finish_run(self, source_files, report_file, prometheus_file):
+        self._print_run_summary()
+        if report_file is not None:
+            with open(report_file, 'w', encoding='utf-8') as f:
+                json.dump(self._run_report(source_files), f, ensure_ascii=False, indent=4)
+        if prometheus_file is not None:
+            self.metrics.write_prometheus(prometheus_file)
+        if self.metrics_hooks:
+            report = self._run_report(source_files)
+            for hook in self.metrics_hooks:
+                hook(report)
+
+    def _dry_run_estimate(self):
+        return {
+            'requests': len(self.dry_run_request_characters),
+            'billable_characters': sum(self.dry_run_request_characters),
+            'cache_hits': self.translation_memory.hits if self.translation_memory is not None else 0,
+            'request_latency_seconds': self.dry_run_latency,
+            'max_concurrency': self.request_scheduler.max_concurrency,
+            'estimated_seconds': self._estimate_seconds(self.dry_run_request_characters),
+        }
+
+    def _estimate_seconds(self, request_characters):
+        if not self.endpoints:
+            return self.request_scheduler.estimate_seconds(request_characters, self.dry_run_latency)
+        # The requests are spread across the endpoints by weight, and each share is estimated with the limits of its endpoint
+        shares = [[] for _ in self.endpoints]
+        for characters in request_characters:
+            i = min(range(len(self.endpoints)), key=lambda i: (len(shares[i]) + 1) / self.endpoints[i]['weight'])
+            shares[i].append(characters)
+        return max(self._endpoint_scheduler(endpoint).estimate_seconds(share, self.dry_run_latency)
+                   for endpoint, share in zip(self.endpoints, shares))
 
+    def _endpoint_stats(self):
+        sharded_backend = self.sharded_backend
+        if sharded_backend is None and isinstance(self.backend, ShardedTranslationBackend):
+            sharded_backend = self.backend
+        if sharded_backend is None:
+            return None
+        return [{'name': e.name, 'weight': e.weight, 'requests': e.requests, 'characters': e.characters, 'throttles': e.throttles}
+                for e in sharded_backend.endpoints]
+
+    def _print_run_summary(self):
+        if self.packing_stats['requests']:
+            print('Packed {} segments ({} codepoints) into {} requests: average fill {:.1%}, minimum fill {:.1%}'.format(
+                self.packing_stats['segments'], self.packing_stats['codepoints'], self.packing_stats['requests'],
+                self.packing_stats['codepoints'] / (self.packing_stats['requests'] * self.split_by_codepoints),
+                self.packing_stats['min_fill_ratio']))
+        if self.incremental:
+            print('Incremental translation: {} unchanged cells reused'.format(self.reused_cell_count))
+        if self.metrics.counters['duplicate_segments']:
+            print('Deduplication: {} duplicate segments ({} characters) not sent'.format(
+                self.metrics.counters['duplicate_segments'], self.metrics.counters['duplicate_characters']))
+        if self.translation_memory is not None:
+            print('Translation memory: {} hits, {} misses'.format(self.translation_memory.hits, self.translation_memory.misses))
+        for endpoint in self._endpoint_stats() or []:
+            print('Endpoint {name}: {requests} requests, {characters} characters, throttled {throttles} times'.format(**endpoint))
+        if self.journal is not None and self.journal.resumed:
+            print('Resumed from {}: {} translations replayed'.format(self.journal.filepath, self.journal.replayed))
+        if self.dry_run:
+            estimate = self._dry_run_estimate()
+            print('Dry run: {} segments ({} billable characters) in {} requests, estimated {:.1f}s '
+                  'at {} requests in flight and {}s per request'.format(
+                      self.metrics.counters['request_segments'], estimate['billable_characters'], estimate['requests'],
+                      estimate['estimated_seconds'], estimate['max_concurrency'], estimate['request_latency_seconds']))
 
     def _validate_inputs(self):
         if not self.source_file or os.path.splitext(self.source_file)[1] != '.ipynb':
             raise OSError('Source file must be a .ipynb file. Provided: {}'.format(self.source_file))
         if not self.target_language:
             raise AttributeError('Target language code (e.g., "ja") must be specified.')
+        if len(self.target_languages) > 1 and self.target_file != self._default_target_file(self.source_file, self.target_language):
+            raise ValueError('target_file cannot be specified when translating into multiple languages.')
 
     def _load_notebook(self, filepath):
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            raise OSError(f"Source file not found: {filepath}")
-        except json.JSONDecodeError:
-            raise ValueError(f"Invalid JSON in source file: {filepath}")
+        # Only the markdown cells are parsed, the other cells are passed through as they are, see notebook_io.py
+        with self.metrics.stage('json_load'):
+            try:
+                return read_notebook(filepath)
+            except FileNotFoundError:
+                raise OSError(f"Source file not found: {filepath}")
+            except ValueError:
+                raise ValueError(f"Invalid JSON in source file: {filepath}")
 
 
     def _save_notebook(self, notebook_content, filepath):
-        try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(notebook_content, f, ensure_ascii=False, indent=4) # Added indent for readability
-        except IOError:
-            raise OSError(f"Could not write to target file: {filepath}")
+        # Written in the same layout as Jupyter (nbformat)
+        with self.metrics.stage('json_save'):
+            try:
+                write_notebook(notebook_content, filepath)
+            except IOError:
+                raise OSError(f"Could not write to target file: {filepath}")
 
-    async def _translate_batch(self, texts):
+    async def _translate_batch(self, texts, target_language=None):
         # The method translates a batch of texts and returns the flattened translated texts.
-        tasks = []
-        batch = []
-        total_len = 0
-        for text in texts:
-            if total_len + len(text) >= self.split_by_codepoints:
-                tasks.append(self._translate(batch))
-                batch = [text]
-                total_len = len(text)
-            else:
-                batch.append(text)
-                total_len += len(text)
-        if batch:
-            tasks.append(self._translate(batch))
+        # Identical texts (e.g. repeated headings or boilerplate) are translated once and their translation fanned out.
+        target_language = target_language or self.target_language
+        unique_texts = list(dict.fromkeys(texts))
+        if len(unique_texts) == len(texts):
+            return await self._translate_unique(texts, target_language)
+        self._record_duplicates(len(texts) - len(unique_texts),
+                                sum(len(t) for t in texts) - sum(len(t) for t in unique_texts))
+        translations = dict(zip(unique_texts, await self._translate_unique(unique_texts, target_language)))
+        return [translations[t] for t in texts]
 
-        results = await asyncio.gather(*tasks)
-        return [item for sublist in results for item in sublist]
+    def _record_duplicates(self, segments, characters):
+        self.metrics.increment('duplicate_segments', segments)
+        self.metrics.increment('duplicate_characters', characters)
 
+    async def _translate_unique(self, texts, target_language):
+        # Texts found in the journal of an interrupted run or in the translation memory are not sent to the API.
+        known_texts = self._lookup_translations(texts, target_language)
+        missed_texts = [t for t, k in zip(texts, known_texts) if k is None]
 
-    async def _translate_notebook_cells(self, ipynb, keep_source):
+        def on_translated(batch, translated_batch):
+            self._store_translations(batch, translated_batch, target_language)
+
+        translated_missed_texts = await self._translate_uncached(missed_texts, target_language, on_translated) if missed_texts else []
+
+        translated_missed_iter = iter(translated_missed_texts)
+        return [k if k is not None else next(translated_missed_iter) for k in known_texts]
+
+    def _lookup_translations(self, texts, target_language):
+        # Returns a list aligned with texts; None marks a text which is neither in the journal nor in the translation memory.
+        known_texts = [None] * len(texts)
+        if self.journal is not None:
+            known_texts = self.journal.get_many(texts, target_language)
+        if self.translation_memory is not None:
+            unknown_texts = [t for t, k in zip(texts, known_texts) if k is None]
+            if unknown_texts:
+                cached_texts = iter(self.translation_memory.get_many(unknown_texts, self.source_language, target_language,
+                                                                     self.mime_type, self._cache_options()))
+                known_texts = [k if k is not None else next(cached_texts) for k in known_texts]
+        return known_texts
+
+    def _store_translations(self, texts, translated_texts, target_language):
+        # Called as each request completes, so that a failed or interrupted run only pays for the failed requests next time.
+        if self.dry_run:
+            return
+        if self.translation_memory is not None:
+            self.translation_memory.put_many(texts, translated_texts, self.source_language, target_language,
+                                             self.mime_type, self._cache_options())
+        if self.journal is not None:
+            self.journal.append(texts, translated_texts, target_language)
+
+    async def _translate_scheduled(self, texts, target_language):
+        characters = sum(len(t) for t in texts)
+        if self.dry_run:
+            # Not sent: the texts stand for their translation, and the request is only counted
+            self.dry_run_request_characters.append(characters)
+            self.metrics.increment('requests')
+            self.metrics.increment('request_segments', len(texts))
+            self.metrics.increment('request_characters', characters)
+            return list(texts)
+        async with self.request_scheduler.slot(characters):
+            start = time.perf_counter()
+            translated_texts = await self._translate(texts, target_language)
+            self.metrics.observe_request(time.perf_counter() - start, len(texts), characters)
+            return translated_texts
+
+    def _retry_delay(self, attempt):
+        delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _translate_with_retry(self, texts, target_language, on_translated=None, attempt=0):
+        # on_translated(batch, translated_batch) is called for each request which succeeds, including each half
+        # of a split request, so that a half is kept even if the other one fails for good.
+        try:
+            translated_texts = await self._translate_scheduled(texts, target_language)
+        except self.retryable_exceptions:
+            if attempt >= self.max_retries:
+                raise
+            self.metrics.increment('retries')
+            await asyncio.sleep(self._retry_delay(attempt))
+            if len(texts) == 1:
+                return await self._translate_with_retry(texts, target_language, on_translated, attempt + 1)
+            half = len(texts) // 2
+            results = await asyncio.gather(self._translate_with_retry(texts[:half], target_language, on_translated, attempt + 1),
+                                           self._translate_with_retry(texts[half:], target_language, on_translated, attempt + 1),
+                                           return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            return results[0] + results[1]
+        if on_translated is not None:
+            on_translated(texts, translated_texts)
+        return translated_texts
+
+    def _pack_batches(self, texts):
+        # Packs the texts into as few requests as possible with best-fit decreasing, under both
+        # the codepoint limit (len() of a str counts codepoints) and the segment count limit.
+        # Returns the lists of indices into texts, each in the original order.
+        with self.metrics.stage('packing'):
+            order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+            bins = []
+            # (remaining codepoints, bin index) of the bins which can still take a segment, sorted
+            open_bins = []
+            for i in order:
+                size = len(texts[i])
+                pos = bisect.bisect_left(open_bins, (size, -1))
+                if pos < len(open_bins):
+                    remaining, bin_idx = open_bins.pop(pos)
+                else:
+                    # A text over the limit gets a request of its own
+                    remaining, bin_idx = self.split_by_codepoints, len(bins)
+                    bins.append([])
+                bins[bin_idx].append(i)
+                remaining -= size
+                if remaining >= 0 and len(bins[bin_idx]) < self.max_segments_per_request:
+                    bisect.insort(open_bins, (remaining, bin_idx))
+
+            batches = sorted(sorted(b) for b in bins)
+            self._record_packing_stats(texts, batches)
+            return batches
+
+    def _new_packing_stats(self):
+        return {'segments': 0, 'requests': 0, 'codepoints': 0, 'min_fill_ratio': 1.0}
+
+    def _record_packing_stats(self, texts, batches):
+        self.packing_stats['segments'] += len(texts)
+        self.packing_stats['requests'] += len(batches)
+        self.packing_stats['codepoints'] += sum(len(t) for t in texts)
+        for batch in batches:
+            fill_ratio = sum(len(texts[i]) for i in batch) / self.split_by_codepoints
+            self.packing_stats['min_fill_ratio'] = min(self.packing_stats['min_fill_ratio'], fill_ratio)
+
+    async def _translate_uncached(self, texts, target_language, on_translated=None):
+        # Requests are created up front, and the scheduler decides when each of them is sent.
+        # on_translated(batch, translated_batch) is called as soon as each request completes.
+        index_batches = self._pack_batches(texts)
+        batches = [[texts[i] for i in indices] for indices in index_batches]
+
+        # Wait for all requests even if some of them fail, so that the completed ones are kept.
+        results = await asyncio.gather(*[self._translate_with_retry(batch, target_language, on_translated) for batch in batches],
+                                       return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            self.metrics.increment('failed_requests', len(errors))
+            raise RuntimeError('{} of {} translation requests failed: {}'.format(len(errors), len(batches), errors[0])) from errors[0]
+
+        translated_texts = [None] * len(texts)
+        for indices, translated_batch in zip(index_batches, results):
+            for i, translated_text in zip(indices, translated_batch):
+                translated_texts[i] = translated_text
+        return translated_texts
+
+
+    def _segment_notebook(self, ipynb, notebook_idx=0):
         # Structure to hold information about each line to be translated
         # This will help in reconstructing the cell later
         lines_to_process_map = {}
-        texts_to_translate = []
-
 
         for cell_idx, cell in enumerate(ipynb.get('cells', [])):
             if cell.get('cell_type') == "markdown":
-                original_source_lines = cell.get('source', []).copy()
-                lines_to_process_map[cell_idx] = []
-
-                skip_translation_block = False
-                current_block_end_symbol = None
-
-                for line_idx, line_content in enumerate(original_source_lines):
-                    stripped_line = line_content.strip()
-                    entry = {
-                        'original_line': line_content,
-                        'prefix': '',
-                        'content_to_translate': '',
-                        'suffix': '',
-                        'translate': False,
-                        'preprocessed_line': '',
-                    }
-
-                    if not skip_translation_block and stripped_line in self.exclude_block_symbol_pair:
-                        skip_translation_block = True
-                        current_block_end_symbol = self.exclude_block_symbol_pair[stripped_line]
-                    elif skip_translation_block:
-                        if stripped_line == current_block_end_symbol:
-                            skip_translation_block = False
-                            current_block_end_symbol = None
-                    else:
-                        preprocessed_line = self._preprocess(line_content)
-                        entry['preprocessed_line'] = preprocessed_line
-                        prefix, content_to_translate, suffix = self._split_start_symbols(preprocessed_line)
-
-                        if content_to_translate:
-                            entry['translate'] = True
-                            entry['prefix'] = prefix
-                            # Split the long line into multiple lines and store them
-                            entry['content_to_translate'] = self._split_lines_by_length(content_to_translate)
-                            texts_to_translate.extend(entry['content_to_translate'])
-                            entry['suffix'] = suffix
-                        else: # No content to translate, store prefix and suffix if they exist
-                            entry['prefix'] = prefix
-                            entry['suffix'] = suffix
-
-                    lines_to_process_map[cell_idx].append(entry)
-
-        translated_texts = await self._translate_batch(texts_to_translate)
-
-        translated_texts_iter = iter(translated_texts)
+                lines_to_process_map[cell_idx] = self._segment_cell(cell)
+                self.metrics.record_cell(notebook_idx, cell_idx, len(lines_to_process_map[cell_idx]),
+                                         self._texts_of_cell(lines_to_process_map[cell_idx]))
+
+        texts_to_translate = self._texts_of_cells(lines_to_process_map)
+        return lines_to_process_map, texts_to_translate
+
+    def _segment_cell(self, cell):
+        with self.metrics.stage('segmentation'):
+            processed_lines_info = []
+            # Lines outside of code and math blocks, which are preprocessed
+            text_lines_info = []
+
+            skip_translation_block = False
+            current_block_end_re = None
+
+            for line_content in cell.get('source', []):
+                stripped_line = line_content.strip()
+                line_info = _LineInfo(line_content)
+
+                block_end_re = None if skip_translation_block else self._block_end_re(stripped_line)
+                if block_end_re is not None:
+                    skip_translation_block = True
+                    current_block_end_re = block_end_re
+                elif skip_translation_block:
+                    if current_block_end_re.fullmatch(stripped_line):
+                        skip_translation_block = False
+                        current_block_end_re = None
+                else:
+                    text_lines_info.append(line_info)
+
+                processed_lines_info.append(line_info)
+
+            # Timed once per cell rather than per line, which would cost more than the preprocessing of short lines
+            with self.metrics.stage('preprocess'):
+                placeholders_by_line = [[] for _ in text_lines_info]
+                preprocessed_lines = [self._preprocess(line_info.original_line, placeholders)
+                                      for line_info, placeholders in zip(text_lines_info, placeholders_by_line)]
+
+            for line_info, preprocessed_line, placeholders in zip(text_lines_info, preprocessed_lines, placeholders_by_line):
+                prefix, content_to_translate, suffix = self._split_start_symbols(preprocessed_line)
+
+                if self._only_protected_spans(content_to_translate):
+                    # Only protected spans, so the original line is kept without sending anything
+                    pass
+                elif content_to_translate:
+                    line_info.translate = True
+                    line_info.prefix = prefix
+                    # Split the long line into multiple lines and store them
+                    line_info.content_to_translate = self._split_lines_by_length(content_to_translate)
+                    line_info.suffix = suffix
+                    if placeholders:
+                        line_info.placeholders = placeholders
+                else: # No content to translate, store prefix and suffix if they exist
+                    line_info.prefix = prefix
+                    line_info.suffix = suffix
+
+            if self.join_paragraphs:
+                self._join_paragraph_lines(processed_lines_info)
+            return processed_lines_info
+
+    def _join_paragraph_lines(self, processed_lines_info):
+        # Joins the contents of consecutive translated lines into the first line of the group with line break tags,
+        # so that a paragraph is translated as one segment. The prefixes and suffixes of each line are kept.
+        # Headings, lines split by length and lines which already contain a line break tag are not joined.
+        group = []
+        group_len = 0
+
+        def flush():
+            if len(group) > 1:
+                group[0].content_to_translate = [self.line_break_tag.join(e.content_to_translate[0] for e in group)]
+                group[0].joined_lines = len(group)
+                for line_info in group[1:]:
+                    line_info.content_to_translate = []
+                    line_info.joined = True
+            group.clear()
+
+        for line_info in processed_lines_info:
+            joinable = (line_info.translate
+                        and len(line_info.content_to_translate) == 1
+                        and not line_info.prefix.strip().startswith('#')
+                        and not self.line_break_re.search(line_info.content_to_translate[0]))
+            if not joinable:
+                flush()
+                group_len = 0
+                continue
+            content_len = len(line_info.content_to_translate[0]) + len(self.line_break_tag)
+            if group and group_len + content_len > self.split_by_length:
+                flush()
+                group_len = 0
+            group.append(line_info)
+            group_len += content_len
+        flush()
+
+    def _split_joined_translation(self, text, num_lines):
+        # Splits a translated paragraph back into lines. If the API dropped or added line breaks,
+        # the extra parts are merged into the last line and missing lines are left empty.
+        parts = self.line_break_re.split(text)
+        if len(parts) > num_lines:
+            parts = parts[:num_lines - 1] + [' '.join(parts[num_lines - 1:])]
+        return parts + [''] * (num_lines - len(parts))
+
+    def _texts_of_cells(self, lines_to_process_map):
+        return [text
+                for processed_lines_info in lines_to_process_map.values()
+                for text in self._texts_of_cell(processed_lines_info)]
+
+    def _texts_of_cell(self, processed_lines_info):
+        return [text
+                for line_info in processed_lines_info if line_info.translate
+                for text in line_info.content_to_translate]
+
+    def _load_previous_translations(self, target_file):
+        # Maps the original lines of each markdown cell, kept in the keep_source comment block
+        # of a previously translated notebook, to the translated lines of the cell.
+        if not os.path.exists(target_file):
+            return {}
+        try:
+            ipynb = self._load_notebook(target_file)
+        except ValueError:
+            return {}
+
+        previous_translations = {}
+        for cell in ipynb.get('cells', []):
+            source = cell.get('source', [])
+            if cell.get('cell_type') != "markdown" or not source or source[-1] != self.keep_source_end:
+                continue
+            if self.keep_source_start not in source:
+                continue
+            start = source.index(self.keep_source_start)
+            previous_translations[tuple(source[start + 1:-1])] = source[:start]
+        return previous_translations
+
+    def _find_reused_cells(self, ipynb, previous_translations):
+        # Returns the translated lines of the cells whose source has not changed, by cell index.
+        if not previous_translations:
+            return {}
+        return {cell_idx: previous_translations[tuple(cell.get('source', []))]
+                for cell_idx, cell in enumerate(ipynb.get('cells', []))
+                if cell.get('cell_type') == "markdown" and tuple(cell.get('source', [])) in previous_translations}
+
+    def _rebuild_notebook(self, ipynb, lines_to_process_map, translated_texts_iter, keep_source, reused_cells=None):
+        # Consumes the translated texts from the iterator in the order _segment_notebook produced them.
+        # The cells in reused_cells take their translation from it instead and consume nothing.
+        reused_cells = reused_cells or {}
         for cell_idx, cell in enumerate(ipynb.get('cells', [])):
-            if cell.get('cell_type') == "markdown":
-                processed_lines_info = lines_to_process_map.get(cell_idx, [])
-                translated_source_lines = []
-                original_cell_lines_for_backup = []
+            if cell_idx in reused_cells:
+                self._reuse_cell(cell, reused_cells[cell_idx], keep_source)
+            elif cell_idx in lines_to_process_map:
+                self._rebuild_cell(cell, lines_to_process_map[cell_idx], translated_texts_iter, keep_source)
+        return ipynb
 
-                for line_info in processed_lines_info:
-                    original_cell_lines_for_backup.append(line_info['original_line'])
-                    if line_info['translate']:
+    def _reuse_cell(self, cell, translated_lines, keep_source):
+        original_cell_lines_for_backup = cell.get('source', [])
+        cell['source'] = list(translated_lines)
+        if keep_source:
+            cell['source'].append(self.keep_source_start)
+            cell['source'].extend(original_cell_lines_for_backup)
+            cell['source'].append(self.keep_source_end)
+
+    def _rebuild_cell(self, cell, processed_lines_info, translated_texts_iter, keep_source):
+        with self.metrics.stage('rebuild'):
+            translated_source_lines = []
+            original_cell_lines_for_backup = []
+            # Translations of the following lines of a joined paragraph
+            joined_translations = []
+            translated_contents = []
+
+            for line_info in processed_lines_info:
+                if line_info.translate:
+                    if line_info.joined:
+                        translated_content = joined_translations.pop(0)
+                    else:
                         # Pop the translated text from the list
-                        translated_content = "".join([next(translated_texts_iter) for _ in range(len(line_info['content_to_translate']))])
+                        translated_content = "".join(itertools.islice(translated_texts_iter, len(line_info.content_to_translate)))
+                    if line_info.joined_lines > 1:
+                        translated_content, *joined_translations = self._split_joined_translation(translated_content, line_info.joined_lines)
 
-                        postprocessed_content = self._postprocess(translated_content)
+                    if line_info.placeholders:
+                        translated_content = self._hide_placeholders(translated_content)
+                    translated_contents.append(translated_content)
 
-                        # Ensure proper spacing for suffix, especially newline
-                        final_suffix = line_info['suffix']
-                        if final_suffix.strip() == '\n' and not postprocessed_content.endswith('\n') and not line_info['prefix'].endswith('\n'):
-                             if not (line_info['prefix'].strip().endswith('-') or line_info['prefix'].strip().endswith('*') or line_info['prefix'].strip().startswith('#')):
-                                 final_suffix = '  \n'
+            # Timed once per cell rather than per line, like preprocess in _segment_cell
+            with self.metrics.stage('postprocess'):
+                postprocessed_contents = iter([self._fix_slashes(self._postprocess(t)) for t in translated_contents])
 
-                        final_line = line_info['prefix'] + re.sub(r"\s?/\s?", "/", postprocessed_content) + final_suffix
-                        translated_source_lines.append(final_line)
-                    else:
-                        # If not translated, reconstruct from original or from prefix/suffix if split was attempted
-                        if not line_info['prefix'] and not line_info['suffix'] and not line_info['content_to_translate']:
-                             translated_source_lines.append(line_info['original_line'])
-                        else: # Handles lines that were split but had no content_to_translate (e.g. empty lines, lines with only markdown symbols)
-                             translated_source_lines.append(line_info['prefix'] + line_info['content_to_translate'] + line_info['suffix'])
-
-
-                cell['source'] = translated_source_lines
-                if keep_source:
-                    cell['source'].append("\n\n<!--\n")
-                    cell['source'].extend(original_cell_lines_for_backup)
-                    cell['source'].append("\n -->\n")
-        return ipynb
+            for line_info in processed_lines_info:
+                original_cell_lines_for_backup.append(line_info.original_line)
+                if line_info.translate:
+                    postprocessed_content = next(postprocessed_contents)
+                    if line_info.placeholders:
+                        postprocessed_content = self._restore_spans(postprocessed_content, line_info.placeholders)
+
+                    # Ensure proper spacing for suffix, especially newline
+                    final_suffix = line_info.suffix
+                    if final_suffix.strip() == '\n' and not postprocessed_content.endswith('\n') and not line_info.prefix.endswith('\n'):
+                         if not (line_info.prefix.strip().endswith('-') or line_info.prefix.strip().endswith('*') or line_info.prefix.strip().startswith('#')):
+                             final_suffix = '  \n'
+
+                    final_line = line_info.prefix + postprocessed_content + final_suffix
+                    translated_source_lines.append(final_line)
+                else:
+                    # If not translated, reconstruct from original or from prefix/suffix if split was attempted
+                    if not line_info.prefix and not line_info.suffix and not line_info.content_to_translate:
+                         translated_source_lines.append(line_info.original_line)
+                    else: # Handles lines that were split but had no content_to_translate (e.g. empty lines, lines with only markdown symbols)
+                         translated_source_lines.append(line_info.prefix + line_info.content_to_translate + line_info.suffix)
+
+
+            cell['source'] = translated_source_lines
+            if keep_source:
+                cell['source'].append(self.keep_source_start)
+                cell['source'].extend(original_cell_lines_for_backup)
+                cell['source'].append(self.keep_source_end)
+
+    async def _translate_notebook_cells(self, ipynb, keep_source):
+        translated_notebooks = await self._translate_notebooks([ipynb], keep_source)
+        return translated_notebooks[self.target_language][0]
+
+    async def _translate_notebooks(self, ipynbs, keep_source, target_languages=None, previous_translations=None):
+        # Segments of all notebooks are translated together, so requests are packed across notebooks.
+        # The segmentation runs once and is shared by all target languages, which are translated concurrently.
+        # previous_translations[target_language][i] is the result of _load_previous_translations for ipynbs[i];
+        # unchanged cells found there are reused instead of being translated again.
+        # Returns a dict of the target language to the list of translated notebooks.
+        target_languages = target_languages or [self.target_language]
+        previous_translations = previous_translations or {}
+        if self.pipeline:
+            return await self._translate_notebooks_pipelined(ipynbs, keep_source, target_languages, previous_translations)
+        if self.workers:
+            return await self._translate_notebooks_in_workers(ipynbs, keep_source, target_languages, previous_translations)
+        segmented_notebooks = [self._segment_notebook(ipynb, i) for i, ipynb in enumerate(ipynbs)]
+        translated_notebooks, reused_cells_by_language, texts_by_language = self._prepare_target_languages(
+            ipynbs, target_languages, previous_translations,
+            [{cell_idx: self._texts_of_cell(processed_lines_info) for cell_idx, processed_lines_info in lines_to_process_map.items()}
+             for lines_to_process_map, _ in segmented_notebooks])
+
+        with self.metrics.stage('translation'):
+            translated_texts_by_language = await asyncio.gather(
+                *[self._translate_batch(texts_by_language[target_language], target_language) for target_language in target_languages])
+
+        for target_language, translated_texts in zip(target_languages, translated_texts_by_language):
+            translated_texts_iter = iter(translated_texts)
+            for ipynb, (lines_to_process_map, _), reused_cells in zip(translated_notebooks[target_language], segmented_notebooks,
+                                                                     reused_cells_by_language[target_language]):
+                self._rebuild_notebook(ipynb, lines_to_process_map, translated_texts_iter, keep_source, reused_cells)
+        return translated_notebooks
+
+    def _prepare_target_languages(self, ipynbs, target_languages, previous_translations, texts_by_cell=None):
+        # Returns the notebooks to rebuild, the reused cells of each notebook and the texts to translate, by target language.
+        # The last language rebuilds the given notebooks in place, the others work on copies.
+        # texts_by_cell[i] maps the index of each segmented cell of ipynbs[i] to its texts. Without it, no texts are
+        # collected, as the pipelined path collects them cell by cell.
+        target_ipynbs_by_language = {}
+        reused_cells_by_language = {}
+        texts_by_language = {}
+        for i, target_language in enumerate(target_languages):
+            target_ipynbs_by_language[target_language] = ipynbs if i == len(target_languages) - 1 else copy.deepcopy(ipynbs)
+            previous = previous_translations.get(target_language) or [{}] * len(ipynbs)
+            reused_cells_by_language[target_language] = [self._find_reused_cells(ipynb, p) for ipynb, p in zip(ipynbs, previous)]
+            self.reused_cell_count += sum(len(r) for r in reused_cells_by_language[target_language])
+            if texts_by_cell is not None:
+                texts_by_language[target_language] = [
+                    text
+                    for cell_texts, reused_cells in zip(texts_by_cell, reused_cells_by_language[target_language])
+                    for cell_idx, texts in cell_texts.items() if cell_idx not in reused_cells
+                    for text in texts]
+        return target_ipynbs_by_language, reused_cells_by_language, texts_by_language
+
+    def _worker_settings(self):
+        # Attributes which change the segmentation or the rebuild of the cells, copied to the worker processes
+        return {name: getattr(self, name) for name in ('exclude_inline_code', 'exclude_url', 'join_paragraphs', 'split_by_length',
+                                                       'line_break_tag', 'exclude_block_symbol_pair',
+                                                       'keep_source_start', 'keep_source_end')}
+
+    def _worker_chunks(self, cells):
+        return [cells[i:i + self.worker_chunk_cells] for i in range(0, len(cells), self.worker_chunk_cells)]
+
+    async def _translate_notebooks_in_workers(self, ipynbs, keep_source, target_languages, previous_translations):
+        # Same as _translate_notebooks, but the cells are segmented and rebuilt in a pool of processes, so that this CPU work
+        # uses several cores and does not block the event loop. The segment information of each cell (the _LineInfo of its
+        # lines) comes back from the segmentation and is sent to the rebuild of each language, so each cell is segmented once.
+        loop = asyncio.get_running_loop()
+        # Spawned rather than forked, since this process has the threads of the API client
+        with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_initialize_worker, initargs=(self._worker_settings(),)) as executor:
+            markdown_cells = [[(cell_idx, cell.get('source', [])) for cell_idx, cell in enumerate(ipynb.get('cells', []))
+                               if cell.get('cell_type') == 'markdown']
+                              for ipynb in ipynbs]
+            with self.metrics.stage('segmentation'):
+                segmented_chunks = await asyncio.gather(*[
+                    loop.run_in_executor(executor, _segment_cells_in_worker, chunk)
+                    for cells in markdown_cells for chunk in self._worker_chunks(cells)])
+            # Segment information and texts of each markdown cell, by notebook
+            lines_to_process_maps = [{} for _ in ipynbs]
+            segmented_notebooks = [{} for _ in ipynbs]
+            chunks_iter = iter(segmented_chunks)
+            for nb_idx, cells in enumerate(markdown_cells):
+                for _ in self._worker_chunks(cells):
+                    for cell_idx, processed_lines_info in next(chunks_iter):
+                        texts = self._texts_of_cell(processed_lines_info)
+                        lines_to_process_maps[nb_idx][cell_idx] = processed_lines_info
+                        segmented_notebooks[nb_idx][cell_idx] = texts
+                        self.metrics.record_cell(nb_idx, cell_idx, len(processed_lines_info), texts)
+
+            translated_notebooks, reused_cells_by_language, texts_by_language = self._prepare_target_languages(
+                ipynbs, target_languages, previous_translations, segmented_notebooks)
+
+            with self.metrics.stage('translation'):
+                translated_texts_by_language = await asyncio.gather(
+                    *[self._translate_batch(texts_by_language[target_language], target_language) for target_language in target_languages])
+
+            with self.metrics.stage('rebuild'):
+                for target_language, translated_texts in zip(target_languages, translated_texts_by_language):
+                    target_ipynbs = translated_notebooks[target_language]
+                    translated_texts_iter = iter(translated_texts)
+                    tasks = []
+                    for nb_idx, (ipynb, cells) in enumerate(zip(target_ipynbs, markdown_cells)):
+                        reused_cells = reused_cells_by_language[target_language][nb_idx]
+                        cells_to_rebuild = []
+                        for cell_idx, _ in cells:
+                            if cell_idx in reused_cells:
+                                self._reuse_cell(ipynb['cells'][cell_idx], reused_cells[cell_idx], keep_source)
+                            else:
+                                texts = [next(translated_texts_iter) for _ in segmented_notebooks[nb_idx][cell_idx]]
+                                cells_to_rebuild.append((cell_idx, lines_to_process_maps[nb_idx][cell_idx], texts))
+                        tasks.extend((nb_idx, loop.run_in_executor(executor, _rebuild_cells_in_worker, chunk, keep_source))
+                                     for chunk in self._worker_chunks(cells_to_rebuild))
+                    for nb_idx, task in tasks:
+                        for cell_idx, source in await task:
+                            target_ipynbs[nb_idx]['cells'][cell_idx]['source'] = source
+        return translated_notebooks
+
+    async def _translate_notebooks_pipelined(self, ipynbs, keep_source, target_languages, previous_translations):
+        # Same as _translate_notebooks, but cells are segmented one by one and a request is sent as soon as it is full,
+        # while the following cells are still being segmented. Each cell is rebuilt as soon as all of its segments
+        # are translated, and its segment information is released. Requests are packed in order.
+        translated_notebooks, reused_cells_by_language, _ = self._prepare_target_languages(
+            ipynbs, target_languages, previous_translations)
+
+        # Segments waiting for a request to fill up, with their total codepoints, by target language
+        pending = {target_language: ([], 0) for target_language in target_languages}
+        # Slots waiting for each text sent or pending, and the translations received so far, by target language.
+        # A text which is already waiting or translated is not sent again.
+        waiting_slots = {target_language: {} for target_language in target_languages}
+        translations = {target_language: {} for target_language in target_languages}
+        # Cells with segments in flight, by (target language, notebook index, cell index)
+        cell_states = {}
+        tasks = []
+
+        def finish_cell(key):
+            processed_lines_info, translated_texts, _ = cell_states.pop(key)
+            target_language, nb_idx, cell_idx = key
+            cell = translated_notebooks[target_language][nb_idx]['cells'][cell_idx]
+            self._rebuild_cell(cell, processed_lines_info, iter(translated_texts), keep_source)
+
+        def fill_slot(slot, translated_text):
+            key, pos = slot
+            cell_state = cell_states[key]
+            cell_state[1][pos] = translated_text
+            cell_state[2] -= 1
+            if cell_state[2] == 0:
+                finish_cell(key)
+
+        async def send(target_language, texts):
+            def on_translated(batch, translated_batch):
+                self._store_translations(batch, translated_batch, target_language)
+
+            translated_batch = await self._translate_with_retry(texts, target_language, on_translated)
+            for text, translated_text in zip(texts, translated_batch):
+                translations[target_language][text] = translated_text
+                for slot in waiting_slots[target_language].pop(text):
+                    fill_slot(slot, translated_text)
+
+        def flush(target_language):
+            texts, _ = pending[target_language]
+            if texts:
+                self._record_packing_stats(texts, [list(range(len(texts)))])
+                tasks.append(asyncio.ensure_future(send(target_language, texts)))
+                pending[target_language] = ([], 0)
+
+        def enqueue(target_language, text, slot):
+            if text in waiting_slots[target_language]:
+                waiting_slots[target_language][text].append(slot)
+                self._record_duplicates(1, len(text))
+                return
+            waiting_slots[target_language][text] = [slot]
+            texts, codepoints = pending[target_language]
+            if texts and (codepoints + len(text) > self.split_by_codepoints or len(texts) >= self.max_segments_per_request):
+                flush(target_language)
+                texts, codepoints = pending[target_language]
+            texts.append(text)
+            pending[target_language] = (texts, codepoints + len(text))
+
+        for nb_idx, ipynb in enumerate(ipynbs):
+            for cell_idx, cell in enumerate(ipynb.get('cells', [])):
+                if cell.get('cell_type') != "markdown":
+                    continue
+                processed_lines_info = None
+                for target_language in target_languages:
+                    reused_cells = reused_cells_by_language[target_language][nb_idx]
+                    if cell_idx in reused_cells:
+                        target_cell = translated_notebooks[target_language][nb_idx]['cells'][cell_idx]
+                        self._reuse_cell(target_cell, reused_cells[cell_idx], keep_source)
+                        continue
+                    if processed_lines_info is None:
+                        processed_lines_info = self._segment_cell(cell)
+                        texts = self._texts_of_cell(processed_lines_info)
+                        self.metrics.record_cell(nb_idx, cell_idx, len(processed_lines_info), texts)
+
+                    translated_texts = self._lookup_translations(texts, target_language)
+                    for pos, text in enumerate(texts):
+                        if translated_texts[pos] is None and text in translations[target_language]:
+                            translated_texts[pos] = translations[target_language][text]
+                            self._record_duplicates(1, len(text))
+                    key = (target_language, nb_idx, cell_idx)
+                    remaining = sum(1 for t in translated_texts if t is None)
+                    cell_states[key] = [processed_lines_info, translated_texts, remaining]
+                    if remaining == 0:
+                        finish_cell(key)
+                        continue
+                    for pos, (text, translated_text) in enumerate(zip(texts, translated_texts)):
+                        if translated_text is None:
+                            enqueue(target_language, text, (key, pos))
+                # Let the requests which have been sent make progress
+                await asyncio.sleep(0)
+
+        for target_language in target_languages:
+            flush(target_language)
+
+        # Wait for all requests even if some of them fail, so that the completed ones are kept.
+        with self.metrics.stage('translation'):
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            self.metrics.increment('failed_requests', len(errors))
+            raise RuntimeError('{} of {} translation requests failed: {}'.format(len(errors), len(tasks), errors[0])) from errors[0]
+        return translated_notebooks
 
     async def run(self,
             source_file,
@@ -321,18 +1365,120 @@ class NbTranslator():
             project_id=None,
             region='global',
             exclude_inline_code=False,
-            exclude_url=False):
+            exclude_url=False,
+            cache_file=None,
+            cache_size=100000,
+            max_concurrency=10,
+            requests_per_minute=6000,
+            characters_per_minute=6000000,
+            max_segments_per_request=1024,
+            max_retries=5,
+            incremental=False,
+            join_paragraphs=False,
+            pipeline=False,
+            backend=None,
+            report_file=None,
+            prometheus_file=None,
+            per_cell_metrics=False,
+            workers=0,
+            dry_run=False,
+            dry_run_latency=1.0,
+            resume=False,
+            journal_file=None,
+            endpoints=None):
+
+        if self._is_multiple_sources(source_file):
+            # A list of files, directories or glob patterns. Segments of all notebooks are packed into shared requests,
+            # and each result is written next to its source.
+            if target_file is not None:
+                raise ValueError('target_file cannot be specified when translating multiple notebooks.')
+            source_files = self._expand_source_files(source_file, to)
+            if not source_files:
+                raise OSError('No .ipynb files found in: {}'.format(source_file))
+        else:
+            source_files = [source_file]
+
+        self._initialize_backend(backend)
+        self._initialize_settings(source_files[0], target_file, orig, to, project_id, region, exclude_inline_code, exclude_url,
+                                  cache_file, cache_size, dry_run)
+        self._initialize_run_options(max_concurrency, requests_per_minute, characters_per_minute, max_segments_per_request,
+                                     max_retries, incremental, join_paragraphs, pipeline, per_cell_metrics, workers,
+                                     dry_run, dry_run_latency, endpoints)
+        for i, source_file in enumerate(source_files):
+            self.source_file = source_file
+            if i > 0:
+                self.target_file = self._default_target_file(source_file, self.target_language)
+            self._validate_inputs()
+
+        # target_file only applies to a single notebook translated into a single language, see _validate_inputs
+        if target_file is not None and len(self.target_languages) == 1:
+            target_files = {self.target_language: [target_file]}
+        else:
+            target_files = {lang: [self._default_target_file(f, lang) for f in source_files] for lang in self.target_languages}
+        previous_translations = None
+        if self.incremental:
+            previous_translations = {lang: [self._load_previous_translations(f) for f in files]
+                                     for lang, files in target_files.items()}
+
+        notebook_contents = [self._load_notebook(source_file) for source_file in source_files]
+        self._open_journal(source_files, target_files[self.target_language][0], journal_file, resume)
+        try:
+            translated_notebook_contents = await self._translate_notebooks(notebook_contents, keep_source, self.target_languages,
+                                                                           previous_translations)
+        finally:
+            # Kept to resume the run if the translation failed or was interrupted
+            if self.journal is not None:
+                self.journal.close()
+            if self.translation_memory is not None:
+                self.translation_memory.flush()
+
+        # A dry run writes nothing
+        if not self.dry_run:
+            for target_language, translated_notebooks in translated_notebook_contents.items():
+                for source_file, target_file, translated_notebook_content in zip(source_files, target_files[target_language],
+                                                                                 translated_notebooks):
+                    self._save_notebook(translated_notebook_content, target_file)
+                    print('{} version of {} is successfully generated as {}'.format(target_language, source_file, target_file))
+        if self.journal is not None:
+            self.journal.remove()
+        self._finish_run(source_files, report_file, prometheus_file)
+
+    async def run_many(self, source_files, **options):
+        # Translates many notebooks in one process, see run. source_files can be a list of files, directories or glob patterns.
+        if isinstance(source_files, str):
+            source_files = [source_files]
+        return await self.run(source_files, **options)
+
+# Translator of each worker process of _translate_notebooks_in_workers, set by _initialize_worker
+_worker_translator = None
+
+def _initialize_worker(settings):
+    global _worker_translator
+    # The translator of a worker never translates, so it has no translation client
+    _worker_translator = NbTranslator(backend=TranslationBackend())
+    for name, value in settings.items():
+        setattr(_worker_translator, name, value)
 
-        self._initialize_settings(source_file, target_file, orig, to, project_id, region, exclude_inline_code, exclude_url)
-        self._validate_inputs()
-        
-        notebook_content = self._load_notebook(self.source_file)
-        translated_notebook_content = await self._translate_notebook_cells(notebook_content, keep_source)
-        self._save_notebook(translated_notebook_content, self.target_file)
+def _segment_cells_in_worker(cells):
+    # cells is a list of (cell index, source). Returns a list of (cell index, list of _LineInfo).
+    return [(cell_idx, _worker_translator._segment_cell({'source': source})) for cell_idx, source in cells]
 
-        print('{} version of {} is successfully generated as {}'.format(self.target_language, self.source_file, self.target_file))
+def _rebuild_cells_in_worker(cells, keep_source):
+    # cells is a list of (cell index, list of _LineInfo, translated texts). Returns a list of (cell index, translated source).
+    rebuilt_cells = []
+    for cell_idx, processed_lines_info, translated_texts in cells:
+        cell = {}
+        _worker_translator._rebuild_cell(cell, processed_lines_info, iter(translated_texts), keep_source)
+        rebuilt_cells.append((cell_idx, cell['source']))
+    return rebuilt_cells
 
 def main():
+    import fire
+    if sys.argv[1:2] == ['serve']:
+        # nbtl serve: keep a translator running and accept jobs over HTTP, see server.py
+        from .server import serve
+        fire.Fire(serve, command=sys.argv[2:])
+        return
     nb_translator = NbTranslator()
     fire.Fire(nb_translator.run)
 
@@ -0,0 +1,207 @@
+import json
+import re
+
+# orjson or ujson parse the materialized parts of the notebooks faster when they are installed
+try:
+    import orjson as _fast_json
+except ImportError:
+    try:
+        import ujson as _fast_json
+    except ImportError:
+        _fast_json = None
+
+_WHITESPACE_RE = re.compile(rb'[ \t\n\r]*')
+# Strings are skipped with bytes.find, which is much faster than a regular expression on large outputs
+_STRUCTURE_RE = re.compile(rb'["\[\]{}]')
+_SCALAR_RE = re.compile(rb'[^\s,\]}]+')
+_QUOTE = ord('"')
+_BACKSLASH = ord('\\')
+_OPENING = b'[{'
+
+
+class RawCell(dict):
+    # Cell which is not parsed: only its cell_type is available, and it is written back as its original JSON.
+    # Code cells and their outputs (e.g. large base64 images) are never modified by the translation.
+
+    def __init__(self, cell_type, raw):
+        super().__init__(cell_type=cell_type)
+        self.raw = raw
+
+    def __deepcopy__(self, memo):
+        # The original JSON is never modified, so copies of a notebook share it
+        return self
+
+
+def loads(data):
+    if _fast_json is not None:
+        return _fast_json.loads(data)
+    return json.loads(data)
+
+
+def _skip_whitespace(buf, pos):
+    return _WHITESPACE_RE.match(buf, pos).end()
+
+
+def _expect(buf, pos, symbol):
+    if buf[pos:pos + 1] != symbol:
+        raise ValueError('Expected {!r} at position {}'.format(symbol.decode(), pos))
+    return _skip_whitespace(buf, pos + 1)
+
+
+def _string_end(buf, pos):
+    # Returns the end of the JSON string starting at pos
+    end = buf.find(b'"', pos + 1)
+    while end != -1:
+        # The quote is escaped if it follows an odd number of backslashes
+        backslash = end - 1
+        while buf[backslash] == _BACKSLASH:
+            backslash -= 1
+        if (end - 1 - backslash) % 2 == 0:
+            return end + 1
+        end = buf.find(b'"', end + 1)
+    raise ValueError('Unterminated string at position {}'.format(pos))
+
+
+def _value_end(buf, pos):
+    # Returns the end of the JSON value starting at pos, without parsing it
+    if buf[pos:pos + 1] == b'"':
+        return _string_end(buf, pos)
+    if buf[pos:pos + 1] in (b'[', b'{'):
+        depth = 0
+        while True:
+            m = _STRUCTURE_RE.search(buf, pos)
+            if m is None:
+                raise ValueError('Unterminated value at position {}'.format(pos))
+            pos = m.start()
+            token = buf[pos]
+            if token == _QUOTE:
+                pos = _string_end(buf, pos)
+                continue
+            pos += 1
+            if token in _OPENING:
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return pos
+    m = _SCALAR_RE.match(buf, pos)
+    if m is None:
+        raise ValueError('Expected a value at position {}'.format(pos))
+    return m.end()
+
+
+def _key(buf, pos):
+    # Returns the key starting at pos and the start of its value
+    if buf[pos:pos + 1] != b'"':
+        raise ValueError('Expected a key at position {}'.format(pos))
+    end = _string_end(buf, pos)
+    return json.loads(buf[pos:end]), _expect(buf, _skip_whitespace(buf, end), b':')
+
+
+def _object_items(buf, pos):
+    # Yields (key, value start, value end) of the JSON object starting at pos
+    pos = _expect(buf, _skip_whitespace(buf, pos), b'{')
+    if buf[pos:pos + 1] == b'}':
+        return
+    while True:
+        key, pos = _key(buf, pos)
+        end = _value_end(buf, pos)
+        yield key, pos, end
+        pos = _skip_whitespace(buf, end)
+        if buf[pos:pos + 1] == b'}':
+            return
+        pos = _expect(buf, pos, b',')
+
+
+def _has_nbformat_layout(buf, array_start, cell_start, cell_end):
+    # Whether the cells are indented like nbformat writes them, the array by one space and the cells by two
+    return (buf[array_start + 1:cell_start] == b'\n  '
+            and buf.startswith(b'{\n   "', cell_start)
+            and buf.endswith(b'\n  }', cell_start, cell_end))
+
+
+def _read_cells(buf, view, pos):
+    # Returns the cells of the JSON array starting at pos, and the end of the array
+    cells = []
+    array_start = pos
+    pos = _expect(buf, pos, b'[')
+    if buf[pos:pos + 1] == b']':
+        return cells, pos + 1
+    keep_raw = None
+    while True:
+        end = _value_end(buf, pos)
+        if keep_raw is None:
+            # Raw cells are written back with their original indentation, so they are only kept when it is the one of
+            # the rest of the written notebook. The layout is detected on the first cell, otherwise all cells are parsed.
+            keep_raw = _has_nbformat_layout(buf, array_start, pos, end)
+        cells.append(_read_cell(buf, view, pos, end, keep_raw))
+        pos = _skip_whitespace(buf, end)
+        if buf[pos:pos + 1] == b']':
+            return cells, pos + 1
+        pos = _expect(buf, pos, b',')
+
+
+def _read_cell(buf, view, start, end, keep_raw=True):
+    if not keep_raw:
+        return loads(bytes(view[start:end]))
+    for key, value_start, value_end in _object_items(buf, start):
+        if key == 'cell_type':
+            cell_type = json.loads(buf[value_start:value_end])
+            if cell_type == 'markdown':
+                return loads(bytes(view[start:end]))
+            return RawCell(cell_type, view[start:end])
+    return loads(bytes(view[start:end]))
+
+
+def read_notebook(filepath):
+    # Reads a notebook, parsing only its metadata and markdown cells. The other cells are kept as RawCell,
+    # which refer to the bytes of the file instead of copying them, so the memory is about the size of the file.
+    # Raises ValueError for invalid JSON (the contents of the raw cells are only checked to be balanced).
+    with open(filepath, 'rb') as f:
+        buf = f.read()
+    view = memoryview(buf)
+    notebook = {}
+    pos = _expect(buf, _skip_whitespace(buf, 0), b'{')
+    while buf[pos:pos + 1] != b'}':
+        if notebook:
+            pos = _expect(buf, pos, b',')
+        key, pos = _key(buf, pos)
+        # The cells are read in the same scan as the notebook, the other values are parsed
+        if key == 'cells' and buf[pos:pos + 1] == b'[':
+            notebook[key], end = _read_cells(buf, view, pos)
+        else:
+            end = _value_end(buf, pos)
+            notebook[key] = loads(bytes(view[pos:end]))
+        pos = _skip_whitespace(buf, end)
+    if _skip_whitespace(buf, pos + 1) != len(buf):
+        raise ValueError('Extra data after the notebook')
+    return notebook
+
+
+def _dumps(value, depth):
+    # Same layout as nbformat: sorted keys, one space indent and non-ASCII characters kept as is
+    text = json.dumps(value, ensure_ascii=False, indent=1, sort_keys=True)
+    return text.replace('\n', '\n' + ' ' * depth).encode('utf-8')
+
+
+def write_notebook(notebook, filepath):
+    # Writes a notebook in the nbformat layout. Raw cells are written as they were read, which is the nbformat
+    # layout since read_notebook only keeps them for notebooks in that layout.
+    with open(filepath, 'wb') as f:
+        f.write(b'{')
+        for i, key in enumerate(sorted(notebook)):
+            f.write(b',\n ' if i else b'\n ')
+            f.write(_dumps(key, 1) + b': ')
+            value = notebook[key]
+            if key != 'cells' or not isinstance(value, list):
+                f.write(_dumps(value, 1))
+                continue
+            if not value:
+                f.write(b'[]')
+                continue
+            f.write(b'[')
+            for j, cell in enumerate(value):
+                f.write(b',\n  ' if j else b'\n  ')
+                f.write(cell.raw if isinstance(cell, RawCell) else _dumps(cell, 2))
+            f.write(b'\n ]')
+        f.write(b'\n}\n')
@@ -0,0 +1,85 @@
+import asyncio
+import heapq
+import time
+from contextlib import asynccontextmanager
+
+
+class TokenBucket():
+    # Token bucket refilled continuously at rate_per_minute tokens per minute.
+    # The capacity defaults to one second worth of tokens (at least one token): a full minute of tokens on top of the
+    # refill would let twice the per-minute quota through in the first minute, and the API would answer with errors.
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(self.rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount=1):
+        # Waiters are served in order, so a large request is not starved by small ones.
+        # A request larger than the capacity waits for a full bucket and leaves it in debt,
+        # so that the following requests wait until its tokens are refilled.
+        needed = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+
+class RequestScheduler():
+    # Limits the number of requests in flight and the request and character rates.
+    # A rate of None disables the corresponding limit.
+
+    def __init__(self, max_concurrency=10, requests_per_minute=None, characters_per_minute=None):
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.character_bucket = TokenBucket(characters_per_minute) if characters_per_minute else None
+
+    @asynccontextmanager
+    async def slot(self, characters):
+        async with self.semaphore:
+            if self.request_bucket is not None:
+                await self.request_bucket.acquire(1)
+            if self.character_bucket is not None:
+                await self.character_bucket.acquire(characters)
+            yield
+
+    def estimate_seconds(self, request_characters, latency):
+        # Estimates the time to send requests of the given numbers of characters in order, when each of them takes
+        # latency seconds, by replaying the limits of the scheduler without waiting. Used by the dry run of NbTranslator.
+        limits = []
+        if self.request_bucket is not None:
+            limits.append((self.request_bucket, lambda characters: 1))
+        if self.character_bucket is not None:
+            limits.append((self.character_bucket, lambda characters: characters))
+        # Tokens and last update time of each bucket, which starts full like the buckets of a new scheduler
+        states = [[bucket.capacity, 0.0] for bucket, _ in limits]
+        # Times at which each concurrent slot is free
+        slots = [0.0] * self.max_concurrency
+        end = 0.0
+        for characters in request_characters:
+            start = heapq.heappop(slots)
+            for (bucket, amount_of), state in zip(limits, states):
+                amount = amount_of(characters)
+                needed = min(amount, bucket.capacity)
+                tokens, updated_at = state
+                # The requests are served in order, like in TokenBucket.acquire
+                start = max(start, updated_at)
+                tokens = min(bucket.capacity, tokens + (start - updated_at) * bucket.rate)
+                if tokens < needed:
+                    start += (needed - tokens) / bucket.rate
+                    tokens = needed
+                state[:] = [tokens - amount, start]
+            heapq.heappush(slots, start + latency)
+            end = max(end, start + latency)
+        return end
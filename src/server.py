@@ -0,0 +1,145 @@
+import asyncio
+import json
+import time
+
+import google.auth
+
+from .backends import LocalTranslationBackend
+from .nb_translator import NbTranslator, create_translate_client
+from .scheduler import RequestScheduler
+from .translation_memory import TranslationMemory
+
+
+class TranslationServer():
+    # Keeps a translation client, request scheduler and translation memory warm between jobs, so that a job only
+    # pays for its translation. Jobs are posted over HTTP to /translate as a JSON object of the options of
+    # NbTranslator.run, with absolute paths, and run concurrently while sharing the scheduler (see client.py).
+    # There is no authentication, so the server only listens on the loopback interface by default.
+
+    # Options of NbTranslator.run which are fixed by the server for all the jobs
+    server_options = ('project_id', 'backend', 'cache_file', 'cache_size',
+                      'max_concurrency', 'requests_per_minute', 'characters_per_minute', 'endpoints')
+
+    def __init__(self, backend=None, project_id=None, cache_file=None, cache_size=100000,
+                 max_concurrency=10, requests_per_minute=6000, characters_per_minute=6000000, endpoints=None):
+        self.backend = backend
+        self.project_id = project_id
+        self.translate_client = None
+        self.translation_memory = TranslationMemory(cache_file, max_entries=cache_size) if cache_file is not None else None
+        # With several endpoints, the jobs share one sharded backend whose endpoints have their own clients and limits.
+        # It is built by a translator which is only used for that, when the server starts.
+        self.endpoint_translator = None
+        if endpoints:
+            self.endpoint_translator = NbTranslator(backend=backend)
+            self.endpoint_translator.endpoints = self.endpoint_translator._parse_endpoints(
+                endpoints, max_concurrency, requests_per_minute, characters_per_minute)
+            self.request_scheduler = RequestScheduler(sum(e['max_concurrency'] for e in self.endpoint_translator.endpoints))
+        else:
+            self.request_scheduler = RequestScheduler(max_concurrency, requests_per_minute, characters_per_minute)
+        self.max_concurrency = max_concurrency
+        self.jobs = {'running': 0, 'completed': 0, 'failed': 0}
+
+    def _initialize_client(self):
+        # Called from the event loop of the server, which the clients are bound to
+        if self.endpoint_translator is not None:
+            self.endpoint_translator.project_id = self.project_id
+            self.backend = self.endpoint_translator._get_backend()
+            return
+        if self.backend is not None:
+            return
+        self.translate_client = create_translate_client()
+        if self.project_id is None:
+            _, self.project_id = google.auth.default()
+
+    async def translate(self, options):
+        # Runs a job and returns its run report
+        for option in self.server_options:
+            if option in options:
+                raise ValueError('{} is set by the server and cannot be given in a job'.format(option))
+        nb_translator = NbTranslator(backend=self.backend, translate_client=self.translate_client,
+                                     request_scheduler=self.request_scheduler)
+        nb_translator.translation_memory = self.translation_memory
+        reports = []
+        nb_translator.metrics_hooks.append(reports.append)
+
+        self.jobs['running'] += 1
+        try:
+            await nb_translator.run(project_id=self.project_id, max_concurrency=self.max_concurrency, **options)
+        except BaseException:
+            self.jobs['failed'] += 1
+            raise
+        else:
+            self.jobs['completed'] += 1
+        finally:
+            self.jobs['running'] -= 1
+        return reports[0]
+
+    async def _dispatch(self, method, path, body):
+        # Returns the HTTP status and the JSON response
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'ok', 'jobs': self.jobs}
+        if method != 'POST' or path != '/translate':
+            return 404, {'error': 'Unknown endpoint: {} {}'.format(method, path)}
+        try:
+            options = json.loads(body or b'{}')
+            if not isinstance(options, dict):
+                raise ValueError('The job must be a JSON object of the options of nbtl')
+        except ValueError as e:
+            return 400, {'error': str(e)}
+
+        start = time.perf_counter()
+        try:
+            report = await self.translate(options)
+        except (TypeError, ValueError, AttributeError, OSError) as e:
+            # Invalid options or files
+            return 400, {'error': '{}: {}'.format(type(e).__name__, e)}
+        except Exception as e:
+            return 500, {'error': '{}: {}'.format(type(e).__name__, e)}
+        return 200, {'seconds': time.perf_counter() - start, 'report': report}
+
+    async def _handle_connection(self, reader, writer):
+        # Minimal HTTP/1.1: one request per connection, with a Content-Length body
+        try:
+            request_line = await reader.readline()
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, response = 400, {'error': 'Invalid HTTP request: {}'.format(e)}
+        else:
+            status, response = await self._dispatch(method, path, body)
+
+        payload = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}.get(status, 'Internal Server Error')
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'.format(
+            status, reason, len(payload)).encode('latin-1') + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8765):
+        self._initialize_client()
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+
+async def serve(host='127.0.0.1', port=8765, backend=None, project_id=None, cache_file=None, cache_size=100000,
+                max_concurrency=10, requests_per_minute=6000, characters_per_minute=6000000, endpoints=None):
+    # nbtl serve: translates the jobs submitted with nbtl-submit until interrupted.
+    # backend is 'gcp' (the default) for the Cloud Translation API or 'local' for the offline LocalTranslationBackend.
+    # endpoints shares the requests of all the jobs between several projects and regions, see NbTranslator.run.
+    if backend not in (None, 'gcp', 'local'):
+        raise ValueError('Unknown translation backend: {}. Use "gcp" or "local".'.format(backend))
+    translation_server = TranslationServer(LocalTranslationBackend() if backend == 'local' else None, project_id,
+                                           cache_file, cache_size, max_concurrency, requests_per_minute,
+                                           characters_per_minute, endpoints)
+    server = await translation_server.start(host, port)
+    print('Serving translation jobs on http://{}:{}'.format(host, port))
+    async with server:
+        await server.serve_forever()
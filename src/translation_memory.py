@@ -0,0 +1,108 @@
+import hashlib
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+
+class TranslationMemory():
+    # On-disk cache of previous translations backed by SQLite.
+    # Entries are keyed by the preprocessed source text together with the language pair,
+    # the mime type and the preprocessing options, so a change to any of them is a miss.
+    # A read-only memory (e.g. for a dry run) opens an existing database without writing to it,
+    # not even the last use of its entries.
+    # The last use of the hits is written with the next put_many or by flush, rather than by each get_many, so that
+    # many small lookups (e.g. one per cell of a pipelined run) do not each commit a transaction.
+
+    def __init__(self, filepath, max_entries=100000, read_only=False):
+        self.filepath = filepath
+        self.max_entries = max_entries
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        # Last use of the entries hit since the last write, by key
+        self.pending_uses = {}
+
+        if read_only:
+            self.conn = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(filepath))), uri=True)
+            self.clock = 0
+            return
+        dirname = os.path.dirname(os.path.abspath(filepath))
+        os.makedirs(dirname, exist_ok=True)
+        self.conn = sqlite3.connect(filepath)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS translations ('
+                          'key TEXT PRIMARY KEY, '
+                          'translated_text TEXT NOT NULL, '
+                          'last_used INTEGER NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)')
+        self.conn.commit()
+
+        # Monotonic counter used for least-recently-used eviction.
+        self.clock = self.conn.execute('SELECT COALESCE(MAX(last_used), 0) FROM translations').fetchone()[0]
+
+    @staticmethod
+    def make_key(text, source_language, target_language, mime_type, options):
+        # The unit separator cannot appear in the language codes or options, so the key is unambiguous.
+        raw = '\x1f'.join([source_language or '', target_language or '', mime_type or '', options or '', text])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get_many(self, texts, source_language, target_language, mime_type, options):
+        # Returns a list aligned with texts; None marks a miss.
+        keys = [self.make_key(t, source_language, target_language, mime_type, options) for t in texts]
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        # SQLite limits the number of host parameters per statement.
+        for i in range(0, len(unique_keys), 500):
+            chunk = unique_keys[i:i+500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(f'SELECT key, translated_text FROM translations WHERE key IN ({placeholders})', chunk)
+            found.update(rows.fetchall())
+
+        results = [found.get(k) for k in keys]
+        hit_keys = [k for k in unique_keys if k in found]
+        if hit_keys and not self.read_only:
+            self.clock += 1
+            self.pending_uses.update((k, self.clock) for k in hit_keys)
+
+        hits = sum(1 for r in results if r is not None)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, texts, translated_texts, source_language, target_language, mime_type, options):
+        if not texts:
+            return
+        self.clock += 1
+        rows = [(self.make_key(t, source_language, target_language, mime_type, options), tt, self.clock)
+                for t, tt in zip(texts, translated_texts)]
+        self._write_pending_uses()
+        self.conn.executemany('INSERT OR REPLACE INTO translations (key, translated_text, last_used) VALUES (?, ?, ?)', rows)
+        self._evict()
+        self.conn.commit()
+
+    def _write_pending_uses(self):
+        if self.pending_uses:
+            self.conn.executemany('UPDATE translations SET last_used = ? WHERE key = ?',
+                                  [(last_used, k) for k, last_used in self.pending_uses.items()])
+            self.pending_uses = {}
+
+    def flush(self):
+        # Writes the last use of the entries hit since the last write
+        if self.pending_uses:
+            self._write_pending_uses()
+            self.conn.commit()
+
+    def _evict(self):
+        if self.max_entries is None:
+            return
+        count = self.conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute('DELETE FROM translations WHERE key IN '
+                              '(SELECT key FROM translations ORDER BY last_used ASC LIMIT ?)',
+                              (count - self.max_entries,))
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,70 @@
+from unittest import TestCase, mock
+import asyncio
+
+from google.api_core import exceptions as api_exceptions
+
+from src.backends import GcpTranslationBackend, LocalTranslationBackend, ShardedTranslationBackend, TranslationEndpoint
+from src.scheduler import RequestScheduler
+
+
+class TestBackends(TestCase):
+    def test_gcp_translation_backend(self):
+        async def run_test():
+            client = mock.Mock()
+            mock_response = mock.Mock()
+            mock_response.translations = [mock.Mock(translated_text='Hola')]
+            client.translate_text = mock.AsyncMock(return_value=mock_response)
+
+            backend = GcpTranslationBackend(client, 'test-project', 'global')
+            self.assertEqual(await backend.translate(['Hello'], 'en', 'es', 'text/html'), ['Hola'])
+            client.translate_text.assert_called_once_with(request={
+                "parent": "projects/test-project/locations/global",
+                "contents": ['Hello'],
+                "mime_type": 'text/html',
+                "source_language_code": 'en',
+                "target_language_code": 'es',
+            })
+        asyncio.run(run_test())
+
+    def test_local_translation_backend(self):
+        async def run_test():
+            backend = LocalTranslationBackend(dictionary={'Hello': 'こんにちは'})
+            self.assertEqual(await backend.translate(['Hello', 'World'], 'en', 'ja', 'text/html'), ['こんにちは', '[ja] World'])
+            self.assertEqual((backend.requests, backend.segments, backend.characters), (1, 2, 10))
+
+            # Requests over the limits are rejected like the API does
+            backend = LocalTranslationBackend(max_segments=1)
+            with self.assertRaises(api_exceptions.InvalidArgument):
+                await backend.translate(['a', 'b'], 'en', 'ja', 'text/html')
+
+            # Failures are injected deterministically
+            backend = LocalTranslationBackend(failure_rate=1.0)
+            with self.assertRaises(api_exceptions.ServiceUnavailable):
+                await backend.translate(['a'], 'en', 'ja', 'text/html')
+            self.assertEqual(backend.failures, 1)
+        asyncio.run(run_test())
+
+    def test_sharded_translation_backend(self):
+        async def run_test():
+            # Requests are spread by weight
+            heavy = TranslationEndpoint(LocalTranslationBackend(latency=0.01), RequestScheduler(2), weight=2)
+            light = TranslationEndpoint(LocalTranslationBackend(latency=0.01), RequestScheduler(2), weight=1)
+            backend = ShardedTranslationBackend([heavy, light])
+            results = await asyncio.gather(*[backend.translate(['a{}'.format(i)], 'en', 'ja', 'text/html') for i in range(30)])
+            self.assertEqual(results, [['[ja] a{}'.format(i)] for i in range(30)])
+            self.assertEqual((heavy.requests, light.requests), (20, 10))
+
+            # A throttled endpoint is avoided, and its request moves to another endpoint
+            throttled = TranslationEndpoint(LocalTranslationBackend(failure_rate=1.0, failure_exception=api_exceptions.ResourceExhausted),
+                                            RequestScheduler(), weight=10)
+            available = TranslationEndpoint(LocalTranslationBackend(), RequestScheduler())
+            backend = ShardedTranslationBackend([throttled, available])
+            for _ in range(5):
+                self.assertEqual(await backend.translate(['a'], 'en', 'ja', 'text/html'), ['[ja] a'])
+            self.assertEqual((throttled.throttles, available.requests), (1, 5))
+
+            # The error is raised when all the endpoints throttle
+            backend = ShardedTranslationBackend([throttled])
+            with self.assertRaises(api_exceptions.ResourceExhausted):
+                await backend.translate(['a'], 'en', 'ja', 'text/html')
+        asyncio.run(run_test())
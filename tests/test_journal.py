@@ -0,0 +1,50 @@
+from unittest import TestCase
+import os
+import tempfile
+
+from src.journal import TranslationJournal
+
+
+class TestTranslationJournal(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.journal_file = os.path.join(self.tmpdir.name, '.sample.ipynb.ja.journal')
+        self.run_key = {'source_files': ['sample.ipynb'], 'target_languages': ['ja']}
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_resume(self):
+        journal = TranslationJournal(self.journal_file, self.run_key)
+        journal.append(['Hello', 'World'], ['こんにちは', '世界'], 'ja')
+        journal.close()
+        # A line cut by a crash is skipped
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            f.write('{"target_language": "ja", "texts": ["Cut')
+
+        journal = TranslationJournal(self.journal_file, self.run_key, resume=True)
+        self.assertTrue(journal.resumed)
+        self.assertEqual(journal.get_many(['Hello', 'Cut', 'World'], 'ja'), ['こんにちは', None, '世界'])
+        self.assertEqual(journal.get_many(['Hello'], 'ko'), [None])
+        self.assertEqual(journal.replayed, 2)
+        journal.append(['Cut'], ['切断'], 'ja')
+        journal.close()
+
+        journal = TranslationJournal(self.journal_file, self.run_key, resume=True)
+        self.assertEqual(journal.get_many(['Hello', 'Cut'], 'ja'), ['こんにちは', '切断'])
+        journal.remove()
+        self.assertFalse(os.path.exists(self.journal_file))
+        # Removing a journal which is already gone is not an error
+        journal.remove()
+
+    def test_other_run(self):
+        journal = TranslationJournal(self.journal_file, self.run_key)
+        journal.append(['Hello'], ['こんにちは'], 'ja')
+        journal.close()
+
+        # The journal of another run, or a run without resume, starts over
+        for run_key, resume in ((dict(self.run_key, target_languages=['ko']), True), (self.run_key, False)):
+            journal = TranslationJournal(self.journal_file, run_key, resume=resume)
+            self.assertFalse(journal.resumed)
+            self.assertEqual(journal.get_many(['Hello'], 'ja'), [None])
+            journal.close()
@@ -0,0 +1,41 @@
+from unittest import TestCase
+
+from src.metrics import RunMetrics
+
+
+class TestRunMetrics(TestCase):
+    def test_stages_and_counters(self):
+        metrics = RunMetrics(per_cell=True)
+        with metrics.stage('preprocess'):
+            pass
+        with metrics.stage('preprocess'):
+            pass
+        metrics.increment('retries')
+        metrics.record_cell(0, 3, 2, ['aa', 'bbb'])
+        metrics.observe_request(0.07, 2, 5)
+        metrics.observe_request(100, 1, 1)
+
+        report = metrics.to_dict()
+        self.assertEqual(report['stages']['preprocess']['calls'], 2)
+        self.assertEqual(report['counters']['retries'], 1)
+        self.assertEqual(report['counters']['segments'], 2)
+        self.assertEqual(report['counters']['characters'], 5)
+        self.assertEqual(report['counters']['requests'], 2)
+        self.assertEqual(report['cells'], [{'notebook': 0, 'cell': 3, 'lines': 2, 'segments': 2, 'characters': 5}])
+        self.assertEqual(report['request_latency']['buckets']['0.1'], 1)
+        self.assertEqual(report['request_latency']['buckets']['+Inf'], 1)
+        self.assertEqual(report['request_latency']['count'], 2)
+
+    def test_to_prometheus(self):
+        metrics = RunMetrics()
+        with metrics.stage('translation'):
+            pass
+        metrics.observe_request(0.07, 2, 5)
+
+        text = metrics.to_prometheus()
+        self.assertIn('nbtl_stage_wall_seconds{stage="translation"}', text)
+        self.assertIn('nbtl_requests_total 1\n', text)
+        self.assertIn('nbtl_request_latency_seconds_bucket{le="0.05"} 0\n', text)
+        self.assertIn('nbtl_request_latency_seconds_bucket{le="0.1"} 1\n', text)
+        self.assertIn('nbtl_request_latency_seconds_bucket{le="+Inf"} 1\n', text)
+        self.assertIn('nbtl_request_latency_seconds_count 1\n', text)
@@ -2,11 +2,20 @@ from unittest import TestCase, mock
 import os
 import json
 import asyncio # Added asyncio
+import copy
+import pickle
+import random
+import tempfile
+import shutil
 
 from google.cloud import translate
+from google.api_core import exceptions as api_exceptions
 import google.auth
 
+from src.backends import LocalTranslationBackend
+from src import nb_translator as nb_translator_module
 from src.nb_translator import NbTranslator
+from src.translation_memory import TranslationMemory
 
 import warnings
 def ignore_warnings(test_func):
@@ -71,40 +80,107 @@ class TestNbTranslator(TestCase):
         expected = ['a' * 10, 'a']
         self.assertEqual(nb_translator._split_lines_by_length(text), expected)
 
-    def test_exclude_code_highlight(self):
+    def test_split_lines_by_length_boundaries(self):
         nb_translator = self.nb_translator
-
-        text = 'aaa bbb `CCC` ddd `EEE`'
-        expected = 'aaa bbb <span translate="no">`CCC`</span> ddd <span translate="no">`EEE`</span>'
-        self.assertEqual(nb_translator._exclude_code_highlight(text), expected)
-
-    def test_exclude_image_tag(self):
+        nb_translator.split_by_length = 20
+
+        # Sentence boundaries are preferred to whitespaces
+        text = 'Aaa bbb. Ccc ddd eee fff ggg.'
+        self.assertEqual(nb_translator._split_lines_by_length(text), ['Aaa bbb. Ccc ddd ', 'eee fff ggg.'])
+        text = 'Aaaa bbbb cccc. Ddd eee fff ggg.'
+        self.assertEqual(nb_translator._split_lines_by_length(text), ['Aaaa bbbb cccc. ', 'Ddd eee fff ggg.'])
+
+        # Markup is never split
+        nb_translator.split_by_length = 40
+        text = 'a' * 30 + ' <span translate="no">`b c`</span> ddd'
+        chunks = nb_translator._split_lines_by_length(text)
+        self.assertEqual(chunks, ['a' * 30 + ' ', '<span translate="no">`b c`</span> ddd'])
+        nb_translator.split_by_length = 20
+
+        # Combining characters are kept with their base character
+        text = 'a' * 19 + 'e\u0301' + 'a' * 5
+        chunks = nb_translator._split_lines_by_length(text)
+        self.assertEqual(chunks, ['a' * 19, 'e\u0301' + 'a' * 5])
+
+        # Very long lines without boundaries are split by the length
+        nb_translator.split_by_length = 5000
+        text = 'QUJD' * 250000
+        chunks = nb_translator._split_lines_by_length(text)
+        self.assertEqual(''.join(chunks), text)
+        self.assertTrue(all(len(c) == 5000 for c in chunks))
+
+    def test_protect_spans(self):
         nb_translator = self.nb_translator
-        nb_translator.image_placeholders = {}
-
-        text = 'aaa bbb ![image_6.png](attachment:image_6.png) ddd'
-        expected_text = 'aaa bbb <span translate="no">__IMAGE_PLACEHOLDER_0__</span> ddd'
-        expected_placeholders = {'__IMAGE_PLACEHOLDER_0__': '![image_6.png](attachment:image_6.png)'}
-
-        processed_text = nb_translator._exclude_image_tag(text)
-
-        self.assertEqual(processed_text, expected_text)
-        self.assertEqual(nb_translator.image_placeholders, expected_placeholders)
+        nb_translator.exclude_inline_code = True
+        nb_translator.exclude_url = True
+
+        text = ('aaa `CCC` ![image_6.png](attachment:image_6.png) $\\frac{a}{b} + \\sqrt{c_1 + c_2}$ $$\\sum_{i=1}^{n} x_i^2 + y_i^2$$ '
+                '<b>bbb</b> [link](https://example.com/a) https://example.com/b. $5 and $10\n')
+        placeholders = []
+        processed_text = nb_translator._preprocess(text, placeholders)
+        self.assertEqual(processed_text, 'aaa ' + ' '.join('<span translate="no">{}</span>'.format(i) for i in range(4))
+                         + ' <b>bbb</b> [link]<span translate="no">4</span> <span translate="no">5</span>. $5 and $10\n')
+        self.assertEqual(placeholders, ['`CCC`', '![image_6.png](attachment:image_6.png)', '$\\frac{a}{b} + \\sqrt{c_1 + c_2}$',
+                                        '$$\\sum_{i=1}^{n} x_i^2 + y_i^2$$', '(https://example.com/a)', 'https://example.com/b'])
+
+        # Math and images shorter than their placeholder are sent as they are
+        placeholders = []
+        text = 'aaa $x_1$ $$y$$ ![a](b.png)'
+        self.assertEqual(nb_translator._preprocess(text, placeholders), text)
+        self.assertEqual(placeholders, [])
+
+        # Inline code, links and URLs are only protected with their options
+        nb_translator.exclude_inline_code = False
+        nb_translator.exclude_url = False
+        placeholders = []
+        text = 'aaa `code` [link](https://example.com/a/long/path/to/a/page)'
+        self.assertEqual(nb_translator._preprocess(text, placeholders), text)
+        self.assertEqual(placeholders, [])
 
-    def test_restore_image_tags(self):
+    def test_restore_spans(self):
         nb_translator = self.nb_translator
-        nb_translator.image_placeholders = {'__IMAGE_PLACEHOLDER_0__': '![image_6.png](attachment:image_6.png)'}
+        placeholders = ['![image_6.png](attachment:image_6.png)', '`a * b / c`']
+
+        text = 'aaa <span translate="no">0</span> bbb <span translate="no"> 1 </span> * ccc * <span translate="no">2</span>'
+        text = nb_translator._fix_slashes(nb_translator._postprocess(nb_translator._hide_placeholders(text)))
+        self.assertEqual(nb_translator._restore_spans(text, placeholders),
+                         'aaa ![image_6.png](attachment:image_6.png) bbb `a * b / c` *ccc* 2')
 
-        text = 'aaa bbb __IMAGE_PLACEHOLDER_0__ ddd'
-        expected = 'aaa bbb ![image_6.png](attachment:image_6.png) ddd'
+    def test_protected_spans_per_line(self):
+        async def run_test():
+            nb_translator = self.nb_translator
+            nb_translator.exclude_inline_code = True
+            nb_translator.exclude_url = False
+            nb_translator.target_language = 'ja'
+
+            async def mock_translate(batch, target_language=None):
+                return ['[ja] ' + text for text in batch]
+            nb_translator._translate = mock_translate
+
+            cell = {'cell_type': 'markdown', 'source': [
+                'See ![a](attachment:a.png)\n',
+                'and ![b](attachment:b.png) with `x`\n',
+                '![c](attachment:c.png)\n',
+                '~~~~ bash\n', 'echo ```\n', '~~~~\n',
+                '\\begin{align}\n', 'x &= 1\n', '\\end{align}\n',
+                'Done\n']}
+            ipynb = {'cells': [cell]}
+            await nb_translator._translate_notebook_cells(ipynb, keep_source=False)
+            self.assertEqual(cell['source'], [
+                '[ja] See ![a](attachment:a.png)\n',
+                '[ja] and ![b](attachment:b.png) with `x`\n',
+                '![c](attachment:c.png)\n',
+                '~~~~ bash\n', 'echo ```\n', '~~~~\n',
+                '\\begin{align}\n', 'x &= 1\n', '\\end{align}\n',
+                '[ja] Done\n'])
 
-        self.assertEqual(nb_translator._restore_image_tags(text), expected)
+        asyncio.run(run_test())
 
     def test_preprocess(self):
         nb_translator = self.nb_translator
 
         text = 'aaa bbb `CCC` ddd `EEE`'
-        expected = 'aaa bbb <span translate="no">`CCC`</span> ddd <span translate="no">`EEE`</span>'
+        expected = 'aaa bbb <span translate="no">0</span> ddd <span translate="no">1</span>'
 
         nb_translator.exclude_inline_code = True
         nb_translator.exclude_url = False
@@ -143,7 +219,7 @@ class TestNbTranslator(TestCase):
             nb_translator.split_by_codepoints = 10
 
             # Mock the _translate method
-            async def mock_translate(batch):
+            async def mock_translate(batch, target_language=None):
                 await asyncio.sleep(0.01)  # simulate network latency
                 return [f"translated_{t}" for t in batch]
 
@@ -163,8 +239,167 @@ class TestNbTranslator(TestCase):
             expected = ["translated_" + "a" * 5, "translated_" + "b" * 6, "translated_" + "c" * 7]
             self.assertEqual(await nb_translator._translate_batch(texts), expected)
             self.assertEqual(nb_translator._translate.call_count, 3)
+
+            nb_translator._translate.reset_mock()
+
+            # Test case 3: A batch that exceeds the number of segments per request
+            nb_translator.max_segments_per_request = 2
+            texts = ["a", "b", "c", "d", "e"]
+            expected = ["translated_" + t for t in texts]
+            self.assertEqual(await nb_translator._translate_batch(texts), expected)
+            self.assertEqual(nb_translator._translate.call_count, 3)
+        asyncio.run(run_test())
+
+    def test_pack_batches(self):
+        nb_translator = self.nb_translator
+        nb_translator.split_by_codepoints = 10
+
+        # In-order greedy packing would need 3 requests
+        texts = ["a" * 6, "b" * 5, "c" * 4, "d" * 3, "e" * 2]
+        self.assertEqual(nb_translator._pack_batches(texts), [[0, 2], [1, 3, 4]])
+        self.assertEqual(nb_translator.packing_stats['min_fill_ratio'], 1.0)
+
+        # Texts over the limit get a request of their own, and the segment count is limited
+        nb_translator.max_segments_per_request = 2
+        texts = ["a" * 12, "b", "c", "d"]
+        self.assertEqual(nb_translator._pack_batches(texts), [[0], [1, 2], [3]])
+
+        # Codepoints, not UTF-16 code units, are counted
+        nb_translator.max_segments_per_request = 1024
+        texts = ["😀" * 5, "😀" * 5]
+        self.assertEqual(nb_translator._pack_batches(texts), [[0, 1]])
+
+    @ignore_warnings
+    def test_translate_batch_with_translation_memory(self):
+        async def run_test():
+            nb_translator = self.nb_translator
+            nb_translator.source_language = 'en'
+            nb_translator.target_language = 'ja'
+            nb_translator.exclude_inline_code = False
+            nb_translator.exclude_url = False
+
+            async def mock_translate(batch, target_language=None):
+                return [f"translated_{t}" for t in batch]
+
+            nb_translator._translate = mock.AsyncMock(side_effect=mock_translate)
+
+            with tempfile.TemporaryDirectory() as tmpdir:
+                nb_translator.translation_memory = TranslationMemory(os.path.join(tmpdir, 'tm.sqlite'))
+
+                texts = ["a", "b"]
+                self.assertEqual(await nb_translator._translate_batch(texts), ["translated_a", "translated_b"])
+                self.assertEqual(nb_translator._translate.call_count, 1)
+
+                # Only the new text is sent to the API
+                texts = ["a", "c", "b"]
+                self.assertEqual(await nb_translator._translate_batch(texts), ["translated_a", "translated_c", "translated_b"])
+                self.assertEqual(nb_translator._translate.call_count, 2)
+                self.assertEqual(nb_translator._translate.call_args.args[0], ["c"])
+
+                # Everything is cached
+                self.assertEqual(await nb_translator._translate_batch(texts), ["translated_a", "translated_c", "translated_b"])
+                self.assertEqual(nb_translator._translate.call_count, 2)
+                self.assertEqual((nb_translator.translation_memory.hits, nb_translator.translation_memory.misses), (5, 3))
+                nb_translator.translation_memory.close()
+        asyncio.run(run_test())
+
+    @ignore_warnings
+    def test_translate_batch_retry(self):
+        async def run_test():
+            nb_translator = self.nb_translator
+            nb_translator.retry_base_delay = 0
+            nb_translator.max_retries = 2
+
+            # The first request fails, then the split requests succeed
+            calls = []
+            async def mock_translate(batch, target_language=None):
+                calls.append(list(batch))
+                if len(calls) == 1:
+                    raise api_exceptions.ServiceUnavailable('unavailable')
+                return [f"translated_{t}" for t in batch]
+            nb_translator._translate = mock.AsyncMock(side_effect=mock_translate)
+
+            texts = ["a", "b", "c", "d"]
+            self.assertEqual(await nb_translator._translate_batch(texts), ["translated_" + t for t in texts])
+            self.assertEqual(calls, [["a", "b", "c", "d"], ["a", "b"], ["c", "d"]])
+
+            # Non-retryable errors are not retried
+            nb_translator._translate = mock.AsyncMock(side_effect=api_exceptions.InvalidArgument('invalid'))
+            with self.assertRaises(RuntimeError):
+                await nb_translator._translate_batch(texts)
+            self.assertEqual(nb_translator._translate.call_count, 1)
+        asyncio.run(run_test())
+
+    @ignore_warnings
+    def test_translate_batch_partial_failure(self):
+        async def run_test():
+            nb_translator = self.nb_translator
+            nb_translator.split_by_codepoints = 3
+            nb_translator.retry_base_delay = 0
+            nb_translator.max_retries = 1
+            nb_translator.source_language = 'en'
+            nb_translator.target_language = 'ja'
+            nb_translator.exclude_inline_code = False
+            nb_translator.exclude_url = False
+
+            async def mock_translate(batch, target_language=None):
+                if "bb" in batch:
+                    raise api_exceptions.ResourceExhausted('quota')
+                return [f"translated_{t}" for t in batch]
+            nb_translator._translate = mock.AsyncMock(side_effect=mock_translate)
+
+            with tempfile.TemporaryDirectory() as tmpdir:
+                nb_translator.translation_memory = TranslationMemory(os.path.join(tmpdir, 'tm.sqlite'))
+                texts = ["aa", "bb", "cc"]
+                with self.assertRaises(RuntimeError):
+                    await nb_translator._translate_batch(texts)
+
+                # The completed requests are kept, so only the failed one is sent again
+                nb_translator._translate = mock.AsyncMock(side_effect=lambda batch, target_language=None: [f"translated_{t}" for t in batch])
+                self.assertEqual(await nb_translator._translate_batch(texts), ["translated_" + t for t in texts])
+                self.assertEqual(nb_translator._translate.call_args_list, [mock.call(["bb"], 'ja')])
+
+                # The half of a split request which succeeds is kept, even if the other half fails for good
+                nb_translator.split_by_codepoints = 100
+                async def mock_translate_split(batch, target_language=None):
+                    if len(batch) == 4 or "f" in batch:
+                        raise api_exceptions.ServiceUnavailable('unavailable')
+                    return [f"translated_{t}" for t in batch]
+                nb_translator._translate = mock.AsyncMock(side_effect=mock_translate_split)
+                with self.assertRaises(RuntimeError):
+                    await nb_translator._translate_batch(["d", "e", "f", "g"])
+                self.assertEqual(nb_translator.translation_memory.get_many(["d", "e", "f", "g"], 'en', 'ja', nb_translator.mime_type,
+                                                                           nb_translator._cache_options()),
+                                 ["translated_d", "translated_e", None, None])
+                nb_translator.translation_memory.close()
         asyncio.run(run_test())
         
+    @ignore_warnings
+    def test_join_paragraphs(self):
+        async def run_test():
+            nb_translator = self.nb_translator
+            nb_translator.exclude_inline_code = False
+            nb_translator.exclude_url = False
+            nb_translator.join_paragraphs = True
+
+            async def mock_translate(batch, target_language=None):
+                return [t.upper() for t in batch]
+            nb_translator._translate = mock.AsyncMock(side_effect=mock_translate)
+
+            ipynb = {'cells': [{'cell_type': 'markdown', 'source': [
+                '# Title\n', 'First line\n', 'second line\n', '\n', '- Item 1\n', '  - Nested Item\n']}]}
+            _, texts = nb_translator._segment_notebook(ipynb)
+            self.assertEqual(texts, ['Title', 'First line<br>second line', 'Item 1<br>Nested Item'])
+
+            translated = await nb_translator._translate_notebook_cells(ipynb, keep_source=False)
+            self.assertEqual(translated['cells'][0]['source'],
+                             ['# TITLE\n', 'FIRST LINE\n', 'SECOND LINE\n', '\n', '- ITEM 1\n', '  - NESTED ITEM\n'])
+
+            # Missing or extra line breaks in the translation do not lose any text
+            self.assertEqual(nb_translator._split_joined_translation('A', 2), ['A', ''])
+            self.assertEqual(nb_translator._split_joined_translation('A <br> B<br/>C', 2), ['A', 'B C'])
+        asyncio.run(run_test())
+
     def test_remove_no_translate_tag(self):
         nb_translator = self.nb_translator
         
@@ -204,6 +439,28 @@ class TestNbTranslator(TestCase):
         expected = ['()', "'aaa'", '"bbb"', '](', '*aaa* bbb', '**aaa** bbb']
         self.assertEqual([nb_translator._postprocess(t) for t in texts ], expected)
 
+        # The text after an unpaired "*" is trimmed, and removing a tag can form another symbol
+        texts = ['* aaa * bbb * ccc ', '[a]<span translate="no"> (b)</span>', '&#<span translate="no">39;</span>',
+                 '</sp<span translate="no">an>']
+        expected = ['*aaa* bbb *ccc', '[a](b)', "'", '']
+        self.assertEqual([nb_translator._postprocess(t) for t in texts], expected)
+
+    def test_post_process_matches_chained_passes(self):
+        nb_translator = self.nb_translator
+
+        def chained_postprocess(text):
+            text = nb_translator._remove_no_translate_tag(text)
+            text = nb_translator._fix_markdown_symbols(text)
+            text = nb_translator._trim_text_format_symbols(text)
+            return nb_translator._trim_inline_math_equation(text)
+
+        tokens = ['a', ' ', '（', '）', '&#39;', '&quot;', '&#', '39;', ']', ' (', '*', '**', '$', '/',
+                  '<span translate="no">', '</span>', '</sp', 'an>', '<span', ' translate="no">', '0', '\n']
+        rng = random.Random(0)
+        for _ in range(2000):
+            text = ''.join(rng.choice(tokens) for _ in range(rng.randint(1, 12)))
+            self.assertEqual(nb_translator._postprocess(text), chained_postprocess(text), text)
+
     @ignore_warnings
     def test_run(self):
         nb_translator = self.nb_translator
@@ -245,4 +502,399 @@ class TestNbTranslator(TestCase):
                          [c for c in target['cells'] if c['cell_type'] =='code'])
         
         os.remove(expected_target_file)
-        
\ No newline at end of file
+        
+    @ignore_warnings
+    def test_run_many(self):
+        nb_translator = self.nb_translator
+        target_language = 'ja'
+
+        def mock_translate_text(request):
+            mock_response = mock.Mock()
+            mock_response.translations = [mock.Mock(translated_text='こんにちは世界') for _ in request['contents']]
+            return mock_response
+        self.mock_translate_text_method.side_effect = mock_translate_text
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.makedirs(os.path.join(tmpdir, 'sub'))
+            source_files = [os.path.join(tmpdir, 'a.ipynb'), os.path.join(tmpdir, 'sub', 'b.ipynb')]
+            for source_file in source_files:
+                shutil.copy('./tests/sample.ipynb', source_file)
+            # Outputs of a previous run are not translated again
+            shutil.copy('./tests/sample.ipynb', os.path.join(tmpdir, f'{target_language}_a.ipynb'))
+
+            self.assertEqual(nb_translator._expand_source_files(tmpdir, target_language), source_files)
+            with self.assertRaises(ValueError):
+                asyncio.run(nb_translator.run(tmpdir, target_file='out.ipynb', to=target_language, project_id="test-project"))
+
+            asyncio.run(nb_translator.run(tmpdir, to=target_language, project_id="test-project"))
+
+            # Both notebooks fit in a single request
+            self.assertEqual(self.mock_translate_text_method.call_count, 1)
+            for source_file in source_files:
+                target_file = os.path.join(os.path.dirname(source_file), f'{target_language}_{os.path.basename(source_file)}')
+                self.assertTrue(os.path.exists(target_file))
+                with open(target_file, 'r') as f:
+                    target = json.load(f)
+                with open(source_file, 'r') as f:
+                    source = json.load(f)
+                self.assertEqual(len(source['cells']), len(target['cells']))
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, f'{target_language}_{target_language}_a.ipynb')))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # A notebook whose name has glob characters is a single notebook, which target_file applies to
+            source_file = os.path.join(tmpdir, 'lesson[1].ipynb')
+            shutil.copy('./tests/sample.ipynb', source_file)
+            self.assertFalse(nb_translator._is_multiple_sources(source_file))
+            self.assertEqual(nb_translator._expand_source_files([source_file], target_language), [source_file])
+            target_file = os.path.join(tmpdir, 'out.ipynb')
+            asyncio.run(nb_translator.run(source_file, target_file=target_file, to=target_language, project_id="test-project"))
+            self.assertTrue(os.path.exists(target_file))
+
+    @ignore_warnings
+    def test_run_multiple_target_languages(self):
+        nb_translator = self.nb_translator
+
+        def mock_translate_text(request):
+            mock_response = mock.Mock()
+            mock_response.translations = [mock.Mock(translated_text=request['target_language_code']) for _ in request['contents']]
+            return mock_response
+        self.mock_translate_text_method.side_effect = mock_translate_text
+
+        self.assertEqual(nb_translator._parse_target_languages('ja, ko,,ja'), ['ja', 'ko'])
+        self.assertEqual(nb_translator._parse_target_languages(('ja', 'ko')), ['ja', 'ko'])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_file = os.path.join(tmpdir, 'sample.ipynb')
+            shutil.copy('./tests/sample.ipynb', source_file)
+
+            with self.assertRaises(ValueError):
+                asyncio.run(nb_translator.run(source_file, target_file=os.path.join(tmpdir, 'out.ipynb'),
+                                              to='ja,ko', project_id="test-project"))
+
+            with mock.patch.object(nb_translator, '_segment_notebook', wraps=nb_translator._segment_notebook) as mock_segment:
+                asyncio.run(nb_translator.run(source_file, to='ja,ko', project_id="test-project"))
+                # The notebook is segmented only once for all languages
+                self.assertEqual(mock_segment.call_count, 1)
+
+            for target_language in ['ja', 'ko']:
+                with open(os.path.join(tmpdir, f'{target_language}_sample.ipynb'), 'r') as f:
+                    target = json.load(f)
+                markdown_source = ''.join(line for c in target['cells'] if c['cell_type'] == 'markdown' for line in c['source'])
+                self.assertIn(target_language, markdown_source)
+                self.assertNotIn({'ja': 'ko', 'ko': 'ja'}[target_language], markdown_source)
+
+    @ignore_warnings
+    def test_run_incremental(self):
+        nb_translator = self.nb_translator
+
+        def mock_translate_text(request):
+            mock_response = mock.Mock()
+            mock_response.translations = [mock.Mock(translated_text=f'translated {t}') for t in request['contents']]
+            return mock_response
+        self.mock_translate_text_method.side_effect = mock_translate_text
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_file = os.path.join(tmpdir, 'sample.ipynb')
+            target_file = os.path.join(tmpdir, 'ja_sample.ipynb')
+            shutil.copy('./tests/sample.ipynb', source_file)
+            asyncio.run(nb_translator.run(source_file, to='ja', project_id="test-project"))
+            with open(target_file, 'r') as f:
+                first_target = json.load(f)
+
+            # Edit a single cell of the source
+            with open(source_file, 'r') as f:
+                source = json.load(f)
+            source['cells'][0]['source'] = ['# Edited Notebook']
+            with open(source_file, 'w') as f:
+                json.dump(source, f)
+
+            self.mock_translate_text_method.reset_mock()
+            asyncio.run(nb_translator.run(source_file, to='ja', project_id="test-project", incremental=True))
+
+            # Only the edited cell is sent
+            self.assertEqual(self.mock_translate_text_method.call_count, 1)
+            self.assertEqual(self.mock_translate_text_method.call_args.kwargs['request']['contents'], ['Edited Notebook'])
+            self.assertEqual(nb_translator.reused_cell_count, 8)
+
+            with open(target_file, 'r') as f:
+                second_target = json.load(f)
+            self.assertEqual(second_target['cells'][0]['source'][0], '# translated Edited Notebook')
+            self.assertEqual(second_target['cells'][1:], first_target['cells'][1:])
+
+    @ignore_warnings
+    def test_translate_notebooks_pipelined(self):
+        async def run_test():
+            nb_translator = self.nb_translator
+            nb_translator.exclude_inline_code = False
+            nb_translator.exclude_url = False
+            nb_translator.split_by_codepoints = 20
+
+            async def mock_translate(batch, target_language=None):
+                await asyncio.sleep(0.01)
+                return [f"{target_language}:{t}" for t in batch]
+            nb_translator._translate = mock.AsyncMock(side_effect=mock_translate)
+
+            with open('./tests/sample.ipynb', 'r') as f:
+                source = json.load(f)
+
+            nb_translator.pipeline = False
+            expected = await nb_translator._translate_notebooks([copy.deepcopy(source)], True, ['ja', 'ko'])
+
+            nb_translator.pipeline = True
+            nb_translator._translate.reset_mock()
+            translated = await nb_translator._translate_notebooks([copy.deepcopy(source)], True, ['ja', 'ko'])
+            self.assertEqual(translated, expected)
+            self.assertGreater(nb_translator._translate.call_count, 2)
+        asyncio.run(run_test())
+
+    @ignore_warnings
+    def test_run_local_backend(self):
+        # The local backend needs neither the API client nor a GCP project
+        backend = LocalTranslationBackend(failure_rate=0.3, seed=1)
+        nb_translator = NbTranslator(backend=backend)
+        nb_translator.retry_base_delay = 0
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_file = os.path.join(tmpdir, 'sample.ipynb')
+            shutil.copy('./tests/sample.ipynb', source_file)
+            with mock.patch('google.auth.default') as mock_auth_default:
+                asyncio.run(nb_translator.run(source_file, to='ja', max_segments_per_request=4, max_retries=10))
+                mock_auth_default.assert_not_called()
+            # The client is only created for the first request to the API
+            self.assertIsNone(nb_translator._translate_client)
+
+            # Injected failures are retried
+            self.assertGreater(backend.failures, 0)
+            with open(os.path.join(tmpdir, 'ja_sample.ipynb'), 'r') as f:
+                target = json.load(f)
+            self.assertEqual(target['cells'][0]['source'][0], '# [ja] Sample Notebook')
+
+    @ignore_warnings
+    def test_run_cached_without_client(self):
+        # A fully cached run with the API neither looks up the default project nor creates the client
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_file = os.path.join(tmpdir, 'sample.ipynb')
+            shutil.copy('./tests/sample.ipynb', source_file)
+            cache_file = os.path.join(tmpdir, 'tm.sqlite')
+            asyncio.run(NbTranslator(backend=LocalTranslationBackend()).run(source_file, to='ja', cache_file=cache_file))
+
+            nb_translator = NbTranslator()
+            with mock.patch('google.auth.default') as mock_auth_default:
+                asyncio.run(nb_translator.run(source_file, to='ja', cache_file=cache_file))
+                mock_auth_default.assert_not_called()
+            self.assertIsNone(nb_translator._translate_client)
+            self.assertEqual(nb_translator.translation_memory.misses, 0)
+
+    @ignore_warnings
+    def test_run_dry_run(self):
+        # A dry run packs the segments without the API, and writes neither the notebooks nor the translation memory
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_file = os.path.join(tmpdir, 'sample.ipynb')
+            shutil.copy('./tests/sample.ipynb', source_file)
+            cache_file = os.path.join(tmpdir, 'tm.sqlite')
+            report_file = os.path.join(tmpdir, 'report.json')
+            asyncio.run(NbTranslator(backend=LocalTranslationBackend()).run(source_file, to='ja', cache_file=cache_file))
+            os.remove(os.path.join(tmpdir, 'ja_sample.ipynb'))
+            with open(cache_file, 'rb') as f:
+                cache_contents = f.read()
+
+            nb_translator = NbTranslator()
+            with mock.patch('google.auth.default') as mock_auth_default:
+                asyncio.run(nb_translator.run(source_file, to='ja,ko', cache_file=cache_file, max_segments_per_request=4,
+                                              dry_run=True, dry_run_latency=2.0, max_concurrency=2, report_file=report_file))
+                mock_auth_default.assert_not_called()
+            self.assertIsNone(nb_translator._translate_client)
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['report.json', 'sample.ipynb', 'tm.sqlite'])
+            # The translation memory is only read, without updating the last use of its entries
+            with open(cache_file, 'rb') as f:
+                self.assertEqual(f.read(), cache_contents)
+
+            with open(report_file, 'r') as f:
+                estimate = json.load(f)['dry_run']
+            # Japanese is cached, and the 22 segments in Korean take 6 requests, 2 at a time
+            self.assertEqual(estimate['cache_hits'], 22)
+            self.assertEqual(estimate['requests'], 6)
+            self.assertEqual(estimate['estimated_seconds'], 6.0)
+            self.assertEqual(TranslationMemory(cache_file).get_many(['Sample Notebook'], 'en', 'ko', 'text/html', nb_translator._cache_options()),
+                             [None])
+
+            # A missing translation memory is not created
+            asyncio.run(NbTranslator().run(source_file, to='ja', cache_file=os.path.join(tmpdir, 'cache', 'tm.sqlite'), dry_run=True))
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, 'cache')))
+
+    @ignore_warnings
+    def test_run_resume(self):
+        # The requests completed before a failure are journaled, and only the others are sent when resuming
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_file = os.path.join(tmpdir, 'sample.ipynb')
+            shutil.copy('./tests/sample.ipynb', source_file)
+            journal_file = os.path.join(tmpdir, '.sample.ipynb.ja.journal')
+
+            failing_backend = LocalTranslationBackend(failure_rate=0.5, seed=1)
+            with self.assertRaises(RuntimeError):
+                asyncio.run(NbTranslator(backend=failing_backend).run(source_file, to='ja', max_segments_per_request=2,
+                                                                      max_retries=0))
+            self.assertTrue(os.path.exists(journal_file))
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, 'ja_sample.ipynb')))
+
+            backend = LocalTranslationBackend()
+            nb_translator = NbTranslator(backend=backend)
+            asyncio.run(nb_translator.run(source_file, to='ja', max_segments_per_request=2, resume=True))
+            self.assertGreater(failing_backend.segments, 0)
+            self.assertEqual(nb_translator.journal.replayed, failing_backend.segments)
+            self.assertEqual(backend.segments + failing_backend.segments, 22)
+            self.assertFalse(os.path.exists(journal_file))
+            with open(os.path.join(tmpdir, 'ja_sample.ipynb'), 'r') as f:
+                resumed_target = f.read()
+
+            asyncio.run(NbTranslator(backend=LocalTranslationBackend()).run(source_file, to='ja'))
+            with open(os.path.join(tmpdir, 'ja_sample.ipynb'), 'r') as f:
+                self.assertEqual(resumed_target, f.read())
+
+    @ignore_warnings
+    def test_run_concurrent_journals(self):
+        # Concurrent runs of a notebook into other languages, as under nbtl serve, each have their own journal
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_file = os.path.join(tmpdir, 'sample.ipynb')
+            shutil.copy('./tests/sample.ipynb', source_file)
+            output_dir = os.path.join(tmpdir, 'output')
+            os.mkdir(output_dir)
+            journal_files = []
+
+            async def run(target_language, latency):
+                nb_translator = NbTranslator(backend=LocalTranslationBackend(latency=latency))
+                original_translate = nb_translator._translate
+                async def translate(texts, target_language=None):
+                    journal_files.append(nb_translator.journal.filepath)
+                    return await original_translate(texts, target_language)
+                nb_translator._translate = translate
+                await nb_translator.run(source_file, os.path.join(output_dir, '{}_sample.ipynb'.format(target_language)),
+                                        to=target_language, max_segments_per_request=2)
+
+            async def run_concurrently():
+                await asyncio.gather(run('ja', 0.001), run('ko', 0.002))
+
+            asyncio.run(run_concurrently())
+            self.assertEqual(set(journal_files), {os.path.join(os.path.realpath(output_dir), '.sample.ipynb.ja.journal'),
+                                                  os.path.join(os.path.realpath(output_dir), '.sample.ipynb.ko.journal')})
+            self.assertEqual(sorted(os.listdir(output_dir)), ['ja_sample.ipynb', 'ko_sample.ipynb'])
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['output', 'sample.ipynb'])
+
+    @ignore_warnings
+    def test_run_endpoints(self):
+        # Each endpoint has its own client, and the requests are shared between them
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_file = os.path.join(tmpdir, 'sample.ipynb')
+            shutil.copy('./tests/sample.ipynb', source_file)
+            report_file = os.path.join(tmpdir, 'report.json')
+
+            clients = []
+            def create_client():
+                client = mock.Mock()
+                client.translate_text = mock.AsyncMock(side_effect=lambda request: mock.Mock(translations=[
+                    mock.Mock(translated_text='{} {}'.format(request['parent'], text)) for text in request['contents']]))
+                clients.append(client)
+                return client
+
+            nb_translator = NbTranslator()
+            with mock.patch('src.nb_translator.create_translate_client', side_effect=create_client):
+                asyncio.run(nb_translator.run(source_file, to='ja', max_segments_per_request=2, report_file=report_file,
+                                              endpoints=['project-a/global', {'project_id': 'project-b', 'region': 'us-central1',
+                                                                              'weight': 2, 'requests_per_minute': 600}]))
+            self.assertEqual(len(clients), 2)
+            with open(report_file, 'r') as f:
+                endpoints = json.load(f)['endpoints']
+            self.assertEqual([e['name'] for e in endpoints], ['project-a/global', 'project-b/us-central1'])
+            self.assertEqual(sum(e['requests'] for e in endpoints), 11)
+            self.assertGreater(endpoints[1]['requests'], endpoints[0]['requests'])
+
+            with open(os.path.join(tmpdir, 'ja_sample.ipynb'), 'r') as f:
+                target = json.load(f)
+            self.assertIn(target['cells'][0]['source'][0], ['# projects/project-a/locations/global Sample Notebook',
+                                                            '# projects/project-b/locations/us-central1 Sample Notebook'])
+
+            with self.assertRaises(ValueError):
+                asyncio.run(NbTranslator(backend=LocalTranslationBackend()).run(source_file, to='ja', endpoints=[{'project': 'a'}]))
+
+    @ignore_warnings
+    def test_run_deduplicates_segments(self):
+        for pipeline in (False, True):
+            backend = LocalTranslationBackend()
+            nb_translator = NbTranslator(backend=backend)
+            notebook = {'cells': [{'cell_type': 'markdown', 'metadata': {}, 'source': ['## Setup\n', 'Run the following cell\n']}
+                                  for _ in range(5)]}
+
+            with tempfile.TemporaryDirectory() as tmpdir:
+                source_file = os.path.join(tmpdir, 'boilerplate.ipynb')
+                with open(source_file, 'w') as f:
+                    json.dump(notebook, f)
+                asyncio.run(nb_translator.run(source_file, to='ja', keep_source=False, pipeline=pipeline))
+                with open(os.path.join(tmpdir, 'ja_boilerplate.ipynb'), 'r') as f:
+                    target = json.load(f)
+
+            self.assertEqual(backend.segments, 2)
+            self.assertEqual(nb_translator.metrics.counters['duplicate_segments'], 8)
+            for cell in target['cells']:
+                self.assertEqual(cell['source'], ['## [ja] Setup\n', '[ja] Run the following cell\n'])
+
+    @ignore_warnings
+    def test_run_workers(self):
+        # Segmenting and rebuilding the cells in worker processes gives the same notebooks
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_files = []
+            for name in ('a', 'b'):
+                source_files.append(os.path.join(tmpdir, '{}.ipynb'.format(name)))
+                shutil.copy('./tests/sample.ipynb', source_files[-1])
+
+            targets = {}
+            for workers in (0, 2):
+                nb_translator = NbTranslator(backend=LocalTranslationBackend())
+                nb_translator.worker_chunk_cells = 2
+                asyncio.run(nb_translator.run(source_files, to='ja,ko', join_paragraphs=True, workers=workers))
+                targets[workers] = []
+                for lang in ('ja', 'ko'):
+                    for name in ('a', 'b'):
+                        with open(os.path.join(tmpdir, '{}_{}.ipynb'.format(lang, name)), 'r') as f:
+                            targets[workers].append(f.read())
+                        os.remove(os.path.join(tmpdir, '{}_{}.ipynb'.format(lang, name)))
+            self.assertEqual(targets[0], targets[2])
+            self.assertEqual(nb_translator.metrics.counters['segments'], 34)
+
+        # The segment information comes back from the workers, so that the rebuild does not segment the cells again
+        nb_translator_module._initialize_worker(NbTranslator()._worker_settings())
+        source = ['# Title\n', 'See ![image](attachment:image_with_a_long_name.png)\n', '```\n', 'code\n', '```']
+        [(cell_idx, processed_lines_info)] = pickle.loads(pickle.dumps(nb_translator_module._segment_cells_in_worker([(3, source)])))
+        texts = NbTranslator()._texts_of_cell(processed_lines_info)
+        with mock.patch.object(nb_translator_module._worker_translator, '_segment_cell', side_effect=AssertionError):
+            [(cell_idx, translated_source)] = nb_translator_module._rebuild_cells_in_worker(
+                [(cell_idx, processed_lines_info, ['[ja] ' + text for text in texts])], False)
+        self.assertEqual(cell_idx, 3)
+        self.assertEqual(translated_source, ['# [ja] Title\n', '[ja] See ![image](attachment:image_with_a_long_name.png)\n',
+                                             '```\n', 'code\n', '```'])
+
+    @ignore_warnings
+    def test_run_report(self):
+        nb_translator = NbTranslator(backend=LocalTranslationBackend())
+        reports = []
+        nb_translator.metrics_hooks.append(reports.append)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source_file = os.path.join(tmpdir, 'sample.ipynb')
+            report_file = os.path.join(tmpdir, 'report.json')
+            prometheus_file = os.path.join(tmpdir, 'nbtl.prom')
+            shutil.copy('./tests/sample.ipynb', source_file)
+            asyncio.run(nb_translator.run(source_file, to='ja', report_file=report_file, prometheus_file=prometheus_file,
+                                          per_cell_metrics=True))
+
+            with open(report_file, 'r') as f:
+                report = json.load(f)
+            self.assertEqual(report, reports[0])
+            self.assertEqual(report['source_files'], [source_file])
+            for stage in ['json_load', 'segmentation', 'preprocess', 'packing', 'translation', 'rebuild', 'postprocess', 'json_save']:
+                self.assertIn(stage, report['stages'])
+            self.assertEqual(report['counters']['segments'], 22)
+            self.assertEqual(report['counters']['request_segments'], 22)
+            self.assertEqual(report['counters']['requests'], 1)
+            self.assertEqual(len(report['cells']), 9)
+            with open(prometheus_file, 'r') as f:
+                self.assertIn('nbtl_requests_total 1', f.read())
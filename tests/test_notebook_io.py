@@ -0,0 +1,86 @@
+import copy
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from src import notebook_io
+from src.notebook_io import RawCell, read_notebook, write_notebook
+
+
+class TestNotebookIO(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmpdir.name, 'notebook.ipynb')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip_is_byte_identical(self):
+        write_notebook(read_notebook('./tests/sample.ipynb'), self.filepath)
+        with open('./tests/sample.ipynb', 'rb') as f, open(self.filepath, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_raw_cells(self):
+        notebook = {
+            'cells': [
+                {'cell_type': 'markdown', 'metadata': {}, 'source': ['# Title ]}\n', '"quoted" \\ text']},
+                {'cell_type': 'code', 'execution_count': 1, 'metadata': {}, 'source': ['print("]}{[")'],
+                 'outputs': [{'output_type': 'display_data', 'data': {'image/png': 'iVBORw0KGgo' * 100}}]},
+            ],
+            'metadata': {'kernelspec': {'name': 'python3'}},
+            'nbformat': 4,
+            'nbformat_minor': 5,
+        }
+        with open(self.filepath, 'w') as f:
+            json.dump(notebook, f, indent=1, sort_keys=True)
+
+        loaded = read_notebook(self.filepath)
+        self.assertEqual(loaded['cells'][0], notebook['cells'][0])
+        self.assertIsInstance(loaded['cells'][1], RawCell)
+        self.assertEqual(loaded['cells'][1], {'cell_type': 'code'})
+        self.assertEqual(loaded['metadata'], notebook['metadata'])
+        self.assertIs(copy.deepcopy(loaded)['cells'][1], loaded['cells'][1])
+
+        loaded['cells'][0]['source'] = ['# タイトル\n']
+        write_notebook(loaded, self.filepath)
+        with open(self.filepath, 'r', encoding='utf-8') as f:
+            text = f.read()
+        notebook['cells'][0]['source'] = ['# タイトル\n']
+        self.assertEqual(json.loads(text), notebook)
+        # Materialized values are written in the nbformat layout
+        self.assertTrue(text.startswith('{\n "cells": [\n  {\n   "cell_type": "markdown",\n   "metadata": {},\n   "source": [\n    "# タイトル\\n"\n   ]\n  },'))
+        self.assertTrue(text.endswith('\n "nbformat": 4,\n "nbformat_minor": 5\n}\n'))
+
+    def test_other_layout_is_reindented(self):
+        notebook = {
+            'cells': [
+                {'cell_type': 'markdown', 'metadata': {}, 'source': ['# Title\n']},
+                {'cell_type': 'code', 'execution_count': 1, 'metadata': {}, 'outputs': [], 'source': ['print(1)']},
+            ],
+            'metadata': {},
+            'nbformat': 4,
+            'nbformat_minor': 5,
+        }
+        for indent in (None, 4):
+            with open(self.filepath, 'w') as f:
+                json.dump(notebook, f, indent=indent)
+            loaded = read_notebook(self.filepath)
+            # Raw cells would keep the indentation of the input, so all the cells are parsed
+            self.assertNotIsInstance(loaded['cells'][1], RawCell)
+            write_notebook(loaded, self.filepath)
+            with open(self.filepath, 'r', encoding='utf-8') as f:
+                self.assertEqual(f.read(), json.dumps(notebook, indent=1, sort_keys=True) + '\n')
+
+    def test_without_fast_json(self):
+        with mock.patch.object(notebook_io, '_fast_json', None):
+            notebook = read_notebook('./tests/sample.ipynb')
+        with open('./tests/sample.ipynb', 'r') as f:
+            self.assertEqual(notebook['cells'][0], json.load(f)['cells'][0])
+
+    def test_invalid_json(self):
+        for text in ['{"cells": [{"cell_type": "code", "source": ["x"]}', '{"cells": []} x', '[]', '{"cells" []}']:
+            with open(self.filepath, 'w') as f:
+                f.write(text)
+            with self.assertRaises(ValueError):
+                read_notebook(self.filepath)
@@ -0,0 +1,60 @@
+from unittest import TestCase
+import asyncio
+import time
+
+from src.scheduler import RequestScheduler, TokenBucket
+
+
+class TestScheduler(TestCase):
+    def test_token_bucket(self):
+        async def run_test():
+            # 600 tokens per minute = 10 tokens per second, starting with a full bucket of 2 tokens
+            bucket = TokenBucket(600, capacity=2)
+            start = time.monotonic()
+            for _ in range(4):
+                await bucket.acquire(1)
+            # The last 2 tokens need 0.2 seconds to refill
+            self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+            # Requests larger than the capacity do not wait forever, but the next ones wait for their tokens
+            bucket = TokenBucket(6000, capacity=2)
+            await asyncio.wait_for(bucket.acquire(20), timeout=1)
+            start = time.monotonic()
+            await bucket.acquire(1)
+            self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+            # The default capacity is one second of tokens, so the first minute does not get twice the quota
+            self.assertEqual(TokenBucket(6000).capacity, 100)
+            self.assertEqual(TokenBucket(6).capacity, 1)
+        asyncio.run(run_test())
+
+    def test_max_concurrency(self):
+        async def run_test():
+            scheduler = RequestScheduler(max_concurrency=2)
+            in_flight = 0
+            max_in_flight = 0
+
+            async def request():
+                nonlocal in_flight, max_in_flight
+                async with scheduler.slot(10):
+                    in_flight += 1
+                    max_in_flight = max(max_in_flight, in_flight)
+                    await asyncio.sleep(0.01)
+                    in_flight -= 1
+
+            await asyncio.gather(*[request() for _ in range(6)])
+            self.assertEqual(max_in_flight, 2)
+        asyncio.run(run_test())
+
+    def test_estimate_seconds(self):
+        # 6 requests of 1 second, 2 at a time
+        self.assertAlmostEqual(RequestScheduler(max_concurrency=2).estimate_seconds([10] * 6, 1.0), 3.0)
+        # 60 requests per minute: the bucket holds 1 request, so they are sent 1 per second from the start
+        scheduler = RequestScheduler(max_concurrency=1000, requests_per_minute=60)
+        self.assertAlmostEqual(scheduler.estimate_seconds([10] * 120, 0.0), 119.0)
+        # 600 characters per minute: requests of 300 characters are larger than the bucket, and sent every 30 seconds
+        scheduler = RequestScheduler(max_concurrency=10, characters_per_minute=600)
+        self.assertAlmostEqual(scheduler.estimate_seconds([300] * 4, 0.0), 90.0)
+        # 12M characters take about 2 minutes at 6M characters per minute
+        scheduler = RequestScheduler(10, 6000, 6000000)
+        self.assertAlmostEqual(scheduler.estimate_seconds([30000] * 400, 0.2), 119.2)
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import urllib.error
+import urllib.request
+from unittest import TestCase, mock
+
+from src.backends import LocalTranslationBackend, ShardedTranslationBackend
+from src.client import submit
+from src.server import TranslationServer
+
+
+def get(url):
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+
+class TestTranslationServer(TestCase):
+    def test_jobs_share_the_server(self):
+        async def run_test(tmpdir):
+            backend = LocalTranslationBackend(latency=0.01)
+            translation_server = TranslationServer(backend=backend, max_concurrency=2)
+            with mock.patch('google.auth.default') as mock_auth_default:
+                server = await translation_server.start(port=0)
+                mock_auth_default.assert_not_called()
+            url = 'http://127.0.0.1:{}'.format(server.sockets[0].getsockname()[1])
+
+            source_files = []
+            for name in ('a', 'b'):
+                source_files.append(os.path.join(tmpdir, '{}.ipynb'.format(name)))
+                shutil.copy('./tests/sample.ipynb', source_files[-1])
+
+            async with server:
+                # Jobs submitted concurrently, as by a docs build
+                with mock.patch('builtins.print'):
+                    await asyncio.gather(*[asyncio.to_thread(submit, f, url=url, to='ja') for f in source_files])
+
+                health = await asyncio.to_thread(get, url + '/health')
+                self.assertEqual(health, {'status': 'ok', 'jobs': {'running': 0, 'completed': 2, 'failed': 0}})
+
+                # Options set by the server cannot be changed by a job
+                with self.assertRaisesRegex(RuntimeError, 'project_id is set by the server'):
+                    await asyncio.to_thread(submit, source_files[0], url=url, to='ja', project_id='other')
+                with self.assertRaisesRegex(RuntimeError, 'OSError'):
+                    await asyncio.to_thread(submit, os.path.join(tmpdir, 'missing.ipynb'), url=url, to='ja')
+                with self.assertRaises(urllib.error.HTTPError) as cm:
+                    await asyncio.to_thread(get, url + '/unknown')
+                self.assertEqual(cm.exception.code, 404)
+                cm.exception.close()
+
+            # Both jobs went through the shared backend and scheduler
+            self.assertEqual(translation_server.request_scheduler.max_concurrency, 2)
+            self.assertEqual(backend.segments, 44)
+            for name in ('a', 'b'):
+                with open(os.path.join(tmpdir, 'ja_{}.ipynb'.format(name)), 'r') as f:
+                    target = json.load(f)
+                self.assertEqual(target['cells'][0]['source'][0], '# [ja] Sample Notebook')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            asyncio.run(run_test(tmpdir))
+
+    def test_endpoints_are_shared_by_the_jobs(self):
+        async def run_test(tmpdir):
+            backend = LocalTranslationBackend(latency=0.01)
+            translation_server = TranslationServer(backend=backend, max_concurrency=2, endpoints='project-a,project-b/us-central1')
+            # Each endpoint has its own limits, and the shared scheduler allows all of them
+            self.assertEqual(translation_server.request_scheduler.max_concurrency, 4)
+            server = await translation_server.start(port=0)
+            sharded_backend = translation_server.backend
+            self.assertIsInstance(sharded_backend, ShardedTranslationBackend)
+
+            source_files = []
+            for name in ('a', 'b'):
+                source_files.append(os.path.join(tmpdir, '{}.ipynb'.format(name)))
+                shutil.copy('./tests/sample.ipynb', source_files[-1])
+            async with server:
+                with mock.patch('builtins.print'):
+                    reports = await asyncio.gather(*[translation_server.translate({'source_file': f, 'to': 'ja'})
+                                                     for f in source_files])
+                with self.assertRaisesRegex(ValueError, 'endpoints is set by the server'):
+                    await translation_server.translate({'source_file': source_files[0], 'to': 'ja', 'endpoints': 'other'})
+
+            # Both jobs went through the endpoints of the backend built once by the server
+            self.assertIs(translation_server.backend, sharded_backend)
+            self.assertEqual([e.name for e in sharded_backend.endpoints], ['project-a/global', 'project-b/us-central1'])
+            self.assertTrue(all(e.requests > 0 for e in sharded_backend.endpoints))
+            self.assertEqual(sum(e.requests for e in sharded_backend.endpoints), backend.requests)
+            self.assertEqual(backend.segments, 44)
+            self.assertEqual([e['name'] for e in reports[1]['endpoints']], ['project-a/global', 'project-b/us-central1'])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            asyncio.run(run_test(tmpdir))
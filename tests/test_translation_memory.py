@@ -0,0 +1,86 @@
+from unittest import TestCase
+import os
+import sqlite3
+import tempfile
+
+from src.translation_memory import TranslationMemory
+
+
+class TestTranslationMemory(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.tmpdir.name, 'cache', 'tm.sqlite')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_get_and_put(self):
+        tm = TranslationMemory(self.cache_file)
+        args = ('en', 'ja', 'text/html', '')
+
+        self.assertEqual(tm.get_many(['Hello', 'World'], *args), [None, None])
+        tm.put_many(['Hello'], ['こんにちは'], *args)
+        self.assertEqual(tm.get_many(['Hello', 'World'], *args), ['こんにちは', None])
+        self.assertEqual((tm.hits, tm.misses), (1, 3))
+
+        # Other language pairs or options do not hit
+        self.assertEqual(tm.get_many(['Hello'], 'en', 'ko', 'text/html', ''), [None])
+        self.assertEqual(tm.get_many(['Hello'], 'en', 'ja', 'text/html', 'exclude_url=1'), [None])
+        tm.close()
+
+        # Entries persist across instances
+        tm = TranslationMemory(self.cache_file)
+        self.assertEqual(tm.get_many(['Hello'], *args), ['こんにちは'])
+        tm.close()
+
+    def test_eviction(self):
+        tm = TranslationMemory(self.cache_file, max_entries=2)
+        args = ('en', 'ja', 'text/html', '')
+
+        tm.put_many(['a'], ['A'], *args)
+        tm.put_many(['b'], ['B'], *args)
+        # Touch 'a' so that 'b' is the least recently used entry
+        tm.get_many(['a'], *args)
+        tm.put_many(['c'], ['C'], *args)
+
+        self.assertEqual(len(tm), 2)
+        self.assertEqual(tm.get_many(['a', 'b', 'c'], *args), ['A', None, 'C'])
+        tm.close()
+
+    def test_deferred_last_use(self):
+        tm = TranslationMemory(self.cache_file, max_entries=2)
+        args = ('en', 'ja', 'text/html', '')
+        tm.put_many(['a'], ['A'], *args)
+        tm.put_many(['b'], ['B'], *args)
+
+        # Lookups write nothing until the next put_many or flush
+        total_changes = tm.conn.total_changes
+        for _ in range(3):
+            self.assertEqual(tm.get_many(['a'], *args), ['A'])
+        self.assertEqual(tm.conn.total_changes, total_changes)
+        tm.flush()
+        self.assertEqual(tm.conn.total_changes, total_changes + 1)
+        tm.close()
+
+        # The last use of 'a' was written, so 'b' is the least recently used entry
+        tm = TranslationMemory(self.cache_file, max_entries=2)
+        tm.put_many(['c'], ['C'], *args)
+        self.assertEqual(tm.get_many(['a', 'b', 'c'], *args), ['A', None, 'C'])
+        tm.close()
+
+    def test_read_only(self):
+        tm = TranslationMemory(self.cache_file)
+        args = ('en', 'ja', 'text/html', '')
+        tm.put_many(['Hello'], ['こんにちは'], *args)
+        tm.close()
+        with open(self.cache_file, 'rb') as f:
+            contents = f.read()
+
+        # Hits do not update the last use of the entries, and nothing can be written
+        tm = TranslationMemory(self.cache_file, read_only=True)
+        self.assertEqual(tm.get_many(['Hello', 'World'], *args), ['こんにちは', None])
+        with self.assertRaises(sqlite3.OperationalError):
+            tm.put_many(['World'], ['世界'], *args)
+        tm.close()
+        with open(self.cache_file, 'rb') as f:
+            self.assertEqual(f.read(), contents)